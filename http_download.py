@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Descargas de archivos con soporte HTTP de rangos y peticiones condicionales:
+- Range / If-Range: descargas parciales y reanudables (206, 416)
+- ETag fuerte (hash del contenido) con If-None-Match y Last-Modified con
+  If-Modified-Since (304 sin cuerpo)
+- Cache-Control: no-cache (el cliente guarda el archivo pero revalida con el
+  ETag, porque un mismo nombre de salida puede reescribirse)
+"""
+
+import os
+from urllib.parse import quote
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def content_disposition(filename: str) -> str:
+    """Content-Disposition de descarga (RFC 5987 si el nombre no es ASCII)."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match: lista de etiquetas o '*' (comparación débil, como pide la RFC 9110)."""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Un solo rango 'bytes=inicio-fin' (fin incluido) -> (inicio, fin).
+    Devuelve None si el encabezado no es válido (p. ej. inicio > fin) o pide
+    varios rangos, y entonces se responde el archivo completo (RFC 9110);
+    lanza ValueError si el rango es válido pero queda fuera del archivo.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (part.strip() for part in spec.partition("-"))
+    if not sep or not (first or last) or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None  # sintaxis no válida: se ignora el encabezado
+    if first == "":
+        suffix = int(last)  # últimos N bytes
+        if suffix == 0 or size == 0:
+            raise ValueError("rango vacío")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None  # rango no válido: se ignora el encabezado
+    if start >= size:
+        raise ValueError("rango fuera del archivo")
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+def _if_range_allows(request: Request, etag: str, last_modified: str) -> bool:
+    """If-Range: el rango solo vale si el validador coincide con la versión actual."""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag  # requiere comparación fuerte
+    return if_range == last_modified
+
+
+def _iter_file(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_download_response(request: Request, path: Path, filename: str, etag_value: str,
+                           media_type: str = "application/octet-stream") -> Response:
+    """Respuesta de descarga de `path` con ETag fuerte `"etag_value"`."""
+    st = os.stat(path)
+    etag = f'"{etag_value}"'
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": REVALIDATE_CACHE_CONTROL,
+    }
+
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and _if_range_allows(request, etag, last_modified):
+        try:
+            byte_range = _parse_range(range_header, st.st_size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{st.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Disposition"] = content_disposition(filename)
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(_iter_file(path, start, length), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    # Respuesta completa; los encabezados propios tienen prioridad sobre los de FileResponse
+    return _FullFileResponse(path, media_type=media_type, filename=filename, headers=headers)
+
+
+class _FullFileResponse(FileResponse):
+    """FileResponse que siempre envía el archivo completo (los rangos ya se resolvieron arriba)."""
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") == "http":
+            scope = dict(scope)
+            scope["headers"] = [(k, v) for k, v in scope.get("headers", [])
+                                if k.lower() not in (b"range", b"if-range")]
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cola de trabajos en segundo plano para indexar y unir PDFs.
+Enviar un trabajo devuelve su id de inmediato; el trabajo corre en un pool
+de hilos acotado y su estado/progreso se consulta con GET /jobs/{id}.
+"""
+
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+
+class Job:
+    """Estado de un trabajo: queued -> running -> done | error."""
+
+    def __init__(self, kind: str, workspace_id: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.workspace_id = workspace_id
+        self.state = "queued"
+        self.progress = {"files_done": 0, "files_total": None, "pages_done": 0, "pages_total": None}
+        self.result: Optional[Dict] = None
+        self.result_url: Optional[str] = None
+        self.error: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def set_total(self, files: Optional[int] = None, pages: Optional[int] = None):
+        with self._lock:
+            if files is not None:
+                self.progress["files_total"] = files
+            if pages is not None:
+                self.progress["pages_total"] = pages
+
+    def advance(self, files: int = 0, pages: int = 0):
+        with self._lock:
+            self.progress["files_done"] += files
+            self.progress["pages_done"] += pages
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "error")
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "workspace_id": self.workspace_id,
+                "state": self.state,
+                "progress": dict(self.progress),
+                "result_url": self.result_url,
+                "result": self.result,
+                "error": self.error,
+                "status_code": self.status_code,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """
+    Ejecuta trabajos en un ThreadPoolExecutor con `max_workers` hilos y
+    conserva el historial de los últimos `max_history` trabajos. Con
+    `max_queued` trabajos esperando turno, submit() responde 429.
+    """
+
+    def __init__(self, max_workers: int = 2, max_history: int = 500, scheduler=None,
+                 max_queued: Optional[int] = None):
+        """
+        `scheduler` (WorkScheduler) es opcional: si se indica, cada trabajo
+        espera en estado "queued" a tener un cupo de CPU antes de correr.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._scheduler = scheduler
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_history = max_history
+        self.max_queued = max_queued
+
+    def submit(self, kind: str, workspace_id: str, fn: Callable[[Job], Dict],
+               result_url: Optional[Callable[[Dict], Optional[str]]] = None) -> Job:
+        """
+        Encola fn(job) -> dict. `result_url(result)` obtiene la URL del
+        resultado una vez terminado (descarga, índice, etc.).
+        """
+        job = Job(kind, workspace_id)
+        with self._lock:
+            if self.max_queued is not None:
+                queued = sum(1 for j in self._jobs.values() if j.state == "queued")
+                if queued >= self.max_queued:
+                    raise self._busy(queued)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, result_url)
+        return job
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.state == "queued")
+
+    def _busy(self, queued: int) -> HTTPException:
+        """429 con Retry-After (estimado por el planificador si lo hay)."""
+        retry_after = self._scheduler.retry_after(queued) if self._scheduler is not None else 1
+        return HTTPException(status_code=429, detail="Demasiados trabajos en cola, intenta más tarde.",
+                             headers={"Retry-After": str(retry_after)})
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, fn: Callable[[Job], Dict],
+             result_url: Optional[Callable[[Dict], Optional[str]]]):
+        if self._scheduler is None:
+            self._execute(job, fn, result_url)
+            return
+        with self._scheduler.slot(job.kind, limit_queue=False):
+            self._execute(job, fn, result_url)
+
+    def _execute(self, job: Job, fn: Callable[[Job], Dict],
+                 result_url: Optional[Callable[[Dict], Optional[str]]]):
+        job.state = "running"
+        job.started_at = datetime.now().isoformat()
+        try:
+            result = fn(job)
+            job.result = result
+            job.result_url = result_url(result) if result_url else None
+            job.status_code = 200
+            job.state = "done"
+        except HTTPException as e:
+            job.error = str(e.detail)
+            job.status_code = e.status_code
+            job.state = "error"
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status_code = 500
+            job.state = "error"
+        finally:
+            job.finished_at = datetime.now().isoformat()
+
+    def _prune(self):
+        """Descarta los trabajos terminados más antiguos si se supera el historial."""
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.finished][:excess]:
+            del self._jobs[job_id]
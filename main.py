@@ -1,26 +1,57 @@
 # main.py
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Literal
+from starlette.background import BackgroundTask, BackgroundTasks
+from typing import Callable, List, Dict, Optional, Literal
 from pathlib import Path
-from pypdf import PdfReader, PdfWriter
+from pypdf import PdfWriter
 import aiofiles
+import os
 import re
 import json
 import uuid
+import shutil
+import hashlib
+import bisect
+import tempfile
 from datetime import datetime
 
 # Importar módulos especializados
-from pdf_extractor_filename import build_filename_index
-from pdf_extractor_content import build_content_index  
+from pdf_extractor_filename import build_filename_index, extract_codes_from_filename
+from pdf_extractor_content import build_content_index, find_codes
 from pdf_extractor_hybrid import build_hybrid_index
+from pdf_text_cache import configure_text_cache, file_sha256, remember_sha256
+from job_queue import Job, JobManager
+from pdf_reader_pool import ReaderPool
+from workspace_index_store import IndexStore
+from upload_pipeline import UploadPrefetcher
+from merge_result_cache import MergeResultCache
+from pdf_stream import stream_pdf_writer
+from pdf_output_optimizer import deduplicate_objects
+from http_download import content_disposition, file_download_response
+from pdf_geometry import configure_geometry_cache, pdf_geometry
+from pdf_resize import needs_resize, resize_files
+from zip_stream import iter_zip
+from work_scheduler import WorkScheduler
 
 # ========= CONFIG =========
 STORAGE_DIR = Path("./storage").resolve()
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Datos derivados compartidos entre workspaces (directorios con prefijo "_")
+CACHE_DIR = STORAGE_DIR / "_cache"
+TEXT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Texto extraído por página (LRU)
+configure_text_cache(CACHE_DIR / "text", TEXT_CACHE_MAX_BYTES)
+GEOMETRY_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Cajas y rotación por página (LRU)
+configure_geometry_cache(CACHE_DIR / "geometry", GEOMETRY_CACHE_MAX_BYTES)
+
+# PDFs subidos, guardados una sola vez por hash y enlazados en cada workspace
+BLOBS_DIR = STORAGE_DIR / "_blobs"
+BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+
 # Cambia estos orígenes por TU GitHub Pages y/o tu dominio
 ALLOWED_ORIGINS = [
     "https://aaleddyy.app",             # Dominio principal
@@ -33,6 +64,35 @@ ALLOWED_ORIGINS = [
     "*"                                # Temporal para debugging
 ]
 
+# Máximo de procesos para la extracción de texto en paralelo
+MAX_INDEX_WORKERS = os.cpu_count() or 1
+
+# Pool de PdfReader abiertos compartido entre uniones (LRU por cantidad y memoria estimada)
+READER_POOL_MAX_READERS = 32
+READER_POOL_MAX_BYTES = 256 * 1024 * 1024
+
+# Trabajo pesado (indexar, unir, separar, redimensionar): tareas de CPU a la vez,
+# peticiones que pueden esperar turno (más allá se responde 429; así no se agotan
+# los hilos del servidor) y segundos máximos de espera (después, 503)
+HEAVY_MAX_CONCURRENT = os.cpu_count() or 1
+HEAVY_MAX_QUEUED = 16
+HEAVY_QUEUE_TIMEOUT = 30
+
+# Trabajos en segundo plano (indexar/unir): hilos simultáneos, historial retenido
+# y trabajos que pueden esperar turno (más allá, 429 como en las peticiones directas)
+JOB_WORKERS = 2
+JOB_HISTORY = 500
+JOB_MAX_QUEUED = 64
+
+# Hilos que extraen el texto de los PDFs mientras se suben (adelanta el /index)
+UPLOAD_PREFETCH_WORKERS = 1
+
+# Caché de resultados de uniones: límite de PDFs cacheados por workspace (LRU)
+MERGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# order-by-content sin índice al día: hasta cuántos códigos conviene la búsqueda dirigida
+TARGETED_SEARCH_MAX_CODES = 50
+
 # Patrón por defecto para compatibilidad con requests antiguos (genérico)
 DEFAULT_CODE_REGEX = r"\b[A-Za-z]{2,}[-_ ]?\d{1,}[A-Za-z0-9]*\b"
 
@@ -47,11 +107,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+SCHEDULER = WorkScheduler(max_concurrent=HEAVY_MAX_CONCURRENT, max_queued=HEAVY_MAX_QUEUED,
+                          queue_timeout=HEAVY_QUEUE_TIMEOUT)
+JOBS = JobManager(max_workers=JOB_WORKERS, max_history=JOB_HISTORY, scheduler=SCHEDULER,
+                  max_queued=JOB_MAX_QUEUED)
+READERS = ReaderPool(max_readers=READER_POOL_MAX_READERS, max_bytes=READER_POOL_MAX_BYTES)
+PREFETCH = UploadPrefetcher(max_workers=UPLOAD_PREFETCH_WORKERS, scheduler=SCHEDULER)
+RESULTS = MergeResultCache(max_bytes_per_workspace=MERGE_CACHE_MAX_BYTES)
+
 # ========= MODELOS =========
+class PageRegion(BaseModel):
+    band: Optional[Literal["top", "bottom"]] = Field(None, description="Franja superior o inferior de la página.")
+    size: float = Field(0.15, gt=0, le=1, description="Alto de la franja como fracción de la página.")
+    bbox: Optional[List[float]] = Field(
+        None,
+        description="[x0, y0, x1, y1] como fracciones (0-1) de la página, con origen arriba a la izquierda."
+    )
+
 class IndexRequest(BaseModel):
     pattern: str = Field(DEFAULT_CODE_REGEX, description="Regex para contenido (captura códigos alfanuméricos).")
     scan_mode: Literal["content", "filename", "both"] = Field("both", description="Dónde buscar los códigos.")
     max_pages: int = Field(10000, description="Límite de páginas a escanear por archivo.")
+    workers: int = Field(1, ge=1, description="Procesos para extraer texto en paralelo (1 = secuencial; se limita a los núcleos disponibles).")
+    full_rebuild: bool = Field(False, description="Ignorar el índice previo y re-escanear todos los archivos.")
+    prefilter: bool = Field(True, description="Omitir la extracción de texto en páginas sin texto o donde el patrón no puede aparecer.")
+    region: Optional[PageRegion] = Field(None, description="Buscar en contenido solo dentro de esta zona de cada página (p. ej. el encabezado).")
 
 class MergeByCodeRequest(BaseModel):
     order: List[str] = Field(..., description="Ej.: ['ABC123456','XYZ789012','MIA000043525233']")
@@ -63,11 +143,24 @@ class MergeByCodeRequest(BaseModel):
         "first_page",
         description="Si el hit viene del NOMBRE: tomar 1ª página o TODO el PDF."
     )
+    deduplicate: bool = Field(False, description="Fusionar fuentes, imágenes y objetos idénticos entre páginas antes de escribir.")
+
+class BatchMergeByCodeRequest(BaseModel):
+    merges: List[MergeByCodeRequest] = Field(..., description="Una unión por código por cada PDF de salida.")
 
 class MergeByBaseRequest(BaseModel):
     bases: List[str] = Field(..., description="Bases tipo 'ABC123456' o 'MIA000044043205' (busca _0.pdf, _1.pdf...).")
     output_name: str = Field("resultado_por_bases.pdf")
 
+class SplitByCodeRequest(BaseModel):
+    codes: Optional[List[str]] = Field(None, description="Códigos a separar; vacío = todos los del índice.")
+    files: Optional[List[str]] = Field(None, description="Separar solo estos PDFs subidos; vacío = todos.")
+    source_filter: Literal["any", "content", "filename"] = Field(
+        "content",
+        description="Fuente de los hits a usar. Un hit por NOMBRE aporta el PDF completo."
+    )
+    output_prefix: str = Field("", description="Prefijo de cada PDF generado: <prefijo><código>.pdf")
+
 # ========= UTIL =========
 def _ws_dir(ws_id: str) -> Path:
     d = STORAGE_DIR / ws_id
@@ -80,18 +173,49 @@ def _uploads_dir(ws_id: str) -> Path:
     return d
 
 def _index_path(ws_id: str) -> Path:
-    return _ws_dir(ws_id) / "index.json"
+    return _ws_dir(ws_id) / "index.sqlite3"
+
+def _index_store(ws_id: str) -> IndexStore:
+    """Índice SQLite del workspace; la primera vez importa un index.json antiguo."""
+    store = IndexStore(_index_path(ws_id))
+    if ws_id in _LEGACY_CHECKED:
+        return store
+    legacy = _ws_dir(ws_id) / "index.json"
+    if legacy.exists():
+        with SCHEDULER.workspace_lock(ws_id):
+            if legacy.exists() and not store.is_built():
+                with legacy.open("r", encoding="utf-8") as f:
+                    store.import_legacy(json.load(f))
+                legacy.rename(legacy.with_name("index.json.migrated"))
+    _LEGACY_CHECKED.add(ws_id)
+    return store
+
+# Workspaces cuyo index.json antiguo ya se buscó (y migró si existía)
+_LEGACY_CHECKED = set()
 
-def _load_index(ws_id: str) -> Dict:
-    p = _index_path(ws_id)
-    if not p.exists():
-        return {"by_code": {}, "files": []}
-    with p.open("r", encoding="utf-8") as f:
-        return json.load(f)
+def _blob_path(digest: str) -> Path:
+    return BLOBS_DIR / digest[:2] / f"{digest}.pdf"
 
-def _save_index(ws_id: str, index: Dict):
-    with _index_path(ws_id).open("w", encoding="utf-8") as f:
-        json.dump(index, f, ensure_ascii=False, indent=2)
+def _link_blob(blob: Path, target: Path):
+    """
+    Enlaza (hard link) el blob en uploads/ del workspace. Si el archivo ya es
+    ese mismo blob no se toca (mtime intacto, no se re-indexa); si el sistema
+    de archivos no admite enlaces se copia. Al reemplazar un archivo, su blob
+    anterior se borra si ya no lo enlaza ningún workspace (los blobs solo se
+    referencian por hard links, así que st_nlink cuenta sus usos).
+    """
+    if target.exists():
+        if os.path.samefile(blob, target):
+            return
+        old_blob = _blob_path(file_sha256(target))
+        linked = old_blob.exists() and os.path.samefile(old_blob, target)
+        target.unlink()
+        if linked and old_blob.stat().st_nlink == 1:
+            old_blob.unlink()
+    try:
+        os.link(blob, target)
+    except OSError:
+        shutil.copyfile(blob, target)
 
 def _safe_pdf_name(name: str) -> str:
     name = name.strip().replace("\\", "_").replace("/", "_")
@@ -99,23 +223,398 @@ def _safe_pdf_name(name: str) -> str:
         name += ".pdf"
     return name
 
-def _find_parts(base: str, folder: Path) -> List[Path]:
+_PART_NAME = re.compile(r"^(.+)_(\d+)\.pdf$", re.IGNORECASE)
+
+def _parts_map(ws_id: str) -> Dict[str, List[str]]:
     """
-    Busca archivos base_N.pdf y los ordena por N (0,1,2,...).
+    Mapa {base en minúsculas: [base_0.pdf, base_1.pdf, ...]} (ordenado por N)
+    de uploads/, construido en una sola pasada por el directorio y guardado
+    junto al índice. Se reconstruye si cambia el mtime de uploads/ o tras
+    una subida; resolver cada base es entonces una búsqueda en el dict.
     """
-    patron = re.compile(rf"^{re.escape(base)}_(\d+)\.pdf$", re.IGNORECASE)
-    candidatos = []
-    for p in folder.iterdir():
-        if p.is_file() and p.suffix.lower() == ".pdf":
-            m = patron.match(p.name)
-            if m:
-                try:
-                    idx = int(m.group(1))
-                    candidatos.append((idx, p))
-                except ValueError:
-                    pass
-    candidatos.sort(key=lambda t: t[0])
-    return [p for _, p in candidatos]
+    up_dir = _uploads_dir(ws_id)
+    stamp = up_dir.stat().st_mtime_ns
+    store = _index_store(ws_id)
+    parts = store.parts_map(stamp)
+    if parts is not None:
+        return parts
+
+    found: Dict[str, List[tuple]] = {}
+    with os.scandir(up_dir) as entries:
+        for entry in entries:
+            m = _PART_NAME.match(entry.name)
+            if m and entry.is_file():
+                found.setdefault(m.group(1).lower(), []).append((int(m.group(2)), entry.name))
+    for items in found.values():
+        items.sort()
+    store.save_parts(stamp, found)
+    return {base: [name for _, name in items] for base, items in found.items()}
+
+def _find_parts(base: str, folder: Path, parts: Dict[str, List[str]]) -> List[Path]:
+    """Archivos base_N.pdf ordenados por N (0,1,2,...) según el mapa de partes."""
+    return [folder / name for name in parts.get(base.lower(), [])]
+
+def _fingerprint(path: Path, previous: Optional[Dict] = None) -> Dict:
+    """
+    Huella de un archivo subido: tamaño, mtime y SHA-256.
+    Si tamaño y mtime coinciden con la huella previa se reutiliza su hash.
+    """
+    st = path.stat()
+    if previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        return previous
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_sha256(path)}
+
+def _region_bbox(region: Optional[PageRegion]) -> Optional[tuple]:
+    """Normaliza la región pedida a (x0, y0, x1, y1) relativos; None = página completa."""
+    if region is None:
+        return None
+    if region.bbox is not None:
+        if len(region.bbox) != 4:
+            raise HTTPException(status_code=400, detail="region.bbox debe tener 4 valores [x0, y0, x1, y1].")
+        x0, y0, x1, y1 = region.bbox
+        if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+            raise HTTPException(status_code=400, detail="region.bbox debe cumplir 0 <= x0 < x1 <= 1 y 0 <= y0 < y1 <= 1.")
+        return (float(x0), float(y0), float(x1), float(y1))
+    if region.band == "top":
+        return (0.0, 0.0, 1.0, region.size)
+    if region.band == "bottom":
+        return (0.0, 1.0 - region.size, 1.0, 1.0)
+    raise HTTPException(status_code=400, detail="region necesita 'band' o 'bbox'.")
+
+def _params_region(params: Optional[Dict]) -> Optional[tuple]:
+    """Región guardada en los parámetros del índice (como bbox)."""
+    region = (params or {}).get("region")
+    return tuple(region["bbox"]) if region else None
+
+def _scan_files(files: List[Path], req: IndexRequest, job: Optional[Job] = None) -> tuple:
+    """
+    Ejecuta el extractor correspondiente a scan_mode sobre `files`. Los
+    procesos extra se limitan a los cupos libres del planificador.
+    """
+    progress = (lambda pages: job.advance(files=1, pages=pages)) if job else None
+    region = _region_bbox(req.region)
+    if req.scan_mode == "filename":
+        return build_filename_index(files, req.max_pages, progress)
+    if req.scan_mode not in ("content", "both"):
+        raise HTTPException(status_code=400, detail=f"scan_mode no válido: {req.scan_mode}")
+    build = build_content_index if req.scan_mode == "content" else build_hybrid_index
+    with SCHEDULER.extra_slots("index", min(req.workers, MAX_INDEX_WORKERS) - 1) as extra:
+        return build(files, req.pattern, req.max_pages, 1 + extra, progress, req.prefilter, region)
+
+def _refresh_index(ws_id: str, req: IndexRequest, job: Optional[Job] = None) -> tuple:
+    """
+    Actualiza el índice del workspace de forma incremental:
+    solo se escanean archivos nuevos o modificados (según su huella) y se
+    descartan las entradas de archivos eliminados. Si cambian los parámetros
+    de escaneo (o full_rebuild=True) se re-escanea todo.
+
+    Dos actualizaciones del mismo workspace nunca corren a la vez.
+
+    Returns:
+        Tupla (store, debug_log, stats)
+    """
+    # Nunca se espera a las extracciones lanzadas al subir (quien llama ya puede
+    # tener un cupo de CPU que ellas necesitan): las que aún no empezaron se
+    # cancelan y el escaneo extrae esas páginas; lo ya extraído está en caché
+    PREFETCH.cancel(ws_id)
+    with SCHEDULER.workspace_lock(ws_id):
+        return _update_index(ws_id, req, job)
+
+def _update_index(ws_id: str, req: IndexRequest, job: Optional[Job] = None) -> tuple:
+    """Cuerpo de _refresh_index; se ejecuta con el candado del workspace tomado."""
+    up_dir = _uploads_dir(ws_id)
+    files = sorted([p for p in up_dir.glob("*.pdf")], key=lambda p: p.name.lower())
+    if not files:
+        raise HTTPException(status_code=400, detail="No hay PDFs subidos.")
+
+    store = _index_store(ws_id)
+    previous = store.meta()
+    prev_fps: Dict[str, Dict] = previous["fingerprints"]
+    region = _region_bbox(req.region)
+    params = {"pattern": req.pattern, "scan_mode": req.scan_mode, "max_pages": req.max_pages,
+              "prefilter": req.prefilter, "region": {"bbox": list(region)} if region else None}
+    fingerprints = {p.name: _fingerprint(p, prev_fps.get(p.name)) for p in files}
+
+    full = req.full_rebuild or previous["params"] != params
+    if full:
+        to_scan = files
+        removed: List[str] = []
+    else:
+        to_scan = [p for p in files if prev_fps.get(p.name, {}).get("sha256") != fingerprints[p.name]["sha256"]]
+        removed = [name for name in prev_fps if name not in fingerprints]
+
+    stats = {"scanned": len(to_scan), "removed": len(removed), "unchanged": len(files) - len(to_scan),
+             "total_files": len(files)}
+    debug_log = [f"Incremental: {stats['scanned']} nuevos/modificados, {stats['removed']} eliminados, {stats['unchanged']} sin cambios"]
+
+    if not to_scan and not removed and fingerprints == prev_fps:
+        return store, debug_log, stats
+
+    if job:
+        job.set_total(files=len(to_scan))
+
+    scanned: Dict[str, List[Dict]] = {}
+    if to_scan:
+        scanned, scan_log = _scan_files(to_scan, req, job)
+        debug_log.extend(scan_log)
+
+    # El orden de los hits (nombre primero, luego archivo/página) lo da la consulta
+    store.apply_update([p.name for p in files], fingerprints, params, scanned,
+                       dropped=[p.name for p in to_scan] + removed, full=full)
+    return store, debug_log, stats
+
+def _content_hits(ws_id: str, codes: Optional[List[str]] = None,
+                  job: Optional[Job] = None) -> Dict[str, List[Dict]]:
+    """
+    Hits de `codes` (o de todos) para ordenar por contenido. Usa el índice
+    del workspace al día con uploads/: lo construye si no existe y, si
+    existe, re-escanea solo lo que cambió (ver _refresh_index). Un índice
+    solo de nombres no sirve y tampoco se modifica (cambiaría /index y
+    merge-by-code): se escanea el contenido con el mismo patrón sin guardarlo.
+    """
+    req = IndexRequest(**(_index_store(ws_id).meta()["params"] or {}))
+    if req.scan_mode != "filename":
+        store, _, _ = _refresh_index(ws_id, req, job)
+        return store.lookup(codes)
+    req.scan_mode = "both"
+    files = sorted(_uploads_dir(ws_id).glob("*.pdf"), key=lambda p: p.name.lower())
+    if job:
+        job.set_total(files=len(files))
+    by_code, _ = _scan_files(files, req, job)
+    return by_code if codes is None else {c: by_code[c] for c in codes if c in by_code}
+
+def _first_content_pages(ws_id: str, by_code: Dict[str, List[Dict]]) -> Dict[str, Optional[Dict]]:
+    """
+    Primera página (en orden de archivos y páginas) donde está escrito cada
+    código. El índice híbrido no guarda los hits de contenido de un archivo
+    cuyo nombre ya tiene el código (MIA1.pdf con MIA1 en la página 2), así
+    que esos archivos se revisan con la búsqueda dirigida.
+    """
+    first = {code: _first_page_for_code(hits) for code, hits in by_code.items()}
+    named: Dict[str, List[str]] = {}
+    for code, hits in by_code.items():
+        for h in hits:
+            if h.get("source") == "filename":
+                named.setdefault(code, []).append(h["file"])
+    if not named:
+        return first
+
+    up_dir = _uploads_dir(ws_id)
+    files = sorted({name for names in named.values() for name in names}, key=str.lower)
+    params = _index_store(ws_id).meta()["params"] or {}
+    found, _, _ = find_codes([up_dir / name for name in files], list(named),
+                             max_pages=params.get("max_pages", 10000), region=_params_region(params))
+    order = lambda hit: (hit["file"].lower(), hit["page"])
+    for code, hit in found.items():
+        if first.get(code) is None or order(hit) < order(first[code]):
+            first[code] = hit
+    return first
+
+def _index_is_fresh(ws_id: str) -> bool:
+    """True si hay índice con contenido y sus huellas (tamaño/mtime) coinciden con uploads/."""
+    meta = _index_store(ws_id).meta()
+    fingerprints = meta["fingerprints"]
+    if not fingerprints or (meta["params"] or {}).get("scan_mode") not in ("content", "both"):
+        return False
+    files = list(_uploads_dir(ws_id).glob("*.pdf"))
+    if len(files) != len(fingerprints):
+        return False
+    for p in files:
+        fp = fingerprints.get(p.name)
+        st = p.stat()
+        if not fp or fp["size"] != st.st_size or fp["mtime_ns"] != st.st_mtime_ns:
+            return False
+    return True
+
+def _targeted_search(ws_id: str, codes: List[str], job: Optional[Job] = None) -> tuple:
+    """
+    Localiza `codes` sin índice: búsqueda multi-código con salida anticipada
+    en el contenido de las páginas (los nombres de archivo no cuentan).
+
+    Returns:
+        Tupla (ubicaciones {código: hit}, páginas_escaneadas)
+    """
+    files = sorted(_uploads_dir(ws_id).glob("*.pdf"), key=lambda p: p.name.lower())
+    if job:
+        job.set_total(files=len(files))
+    progress = (lambda pages: job.advance(files=1, pages=pages)) if job else None
+    # Misma zona de búsqueda que el índice del workspace, si la tiene
+    region = _params_region(_index_store(ws_id).meta()["params"])
+    found, _, pages_scanned = find_codes(files, codes, progress=progress, region=region)
+    return found, pages_scanned
+
+def _first_page_for_code(hits: List[Dict]) -> Optional[Dict]:
+    """
+    Primer hit de contenido de un código (None si solo aparece en nombres de
+    archivo: ordenar por contenido usa solo páginas donde el código está escrito).
+    """
+    for h in hits:
+        if h.get("source") == "content":
+            return h
+    return None
+
+def _copy_pages_in_order(ws_id: str, plan: List[tuple], job: Optional[Job] = None) -> tuple:
+    """
+    Copia las páginas (archivo, página) de `plan` a un PdfWriter respetando
+    el orden de `plan`, pero recorriendo las fuentes de una en una: cada
+    archivo se presta del pool una sola vez y cada página se inserta en su
+    posición final. Así nunca hay más lectores abiertos que los que permite
+    el pool (READER_POOL_MAX_READERS / READER_POOL_MAX_BYTES).
+
+    Returns:
+        Tupla (writer, posiciones de `plan` que no se pudieron copiar)
+    """
+    by_file: Dict[str, List[int]] = {}
+    for pos, (file_name, _) in enumerate(plan):
+        by_file.setdefault(file_name, []).append(pos)
+
+    uploads_dir = _uploads_dir(ws_id)
+    writer = PdfWriter()
+    placed: List[int] = []  # posiciones de plan ya insertadas, ordenadas
+    failed = set()
+    for file_name, positions in by_file.items():
+        try:
+            with READERS.reader(uploads_dir / file_name, ws_id) as reader:
+                for pos in positions:
+                    try:
+                        page = reader.pages[plan[pos][1]]
+                    except Exception as e:
+                        print(f"Error agregando página {plan[pos][1] + 1} de {file_name}: {e}")
+                        failed.add(pos)
+                        continue
+                    writer.insert_page(page, bisect.bisect_left(placed, pos))
+                    bisect.insort(placed, pos)
+        except Exception as e:
+            print(f"Error procesando {file_name}: {e}")
+            failed.update(set(positions) - set(placed))
+        if job:
+            job.advance(pages=len(positions))
+    return writer, failed
+
+def _workspace_version(ws_id: str) -> str:
+    """Versión del workspace para la caché de resultados: versión del índice + huella de uploads/."""
+    h = hashlib.sha1()
+    with os.scandir(_uploads_dir(ws_id)) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name.lower().endswith(".pdf"):
+                st = entry.stat()
+                h.update(f"{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return f"{_index_store(ws_id).version()}:{h.hexdigest()}"
+
+def _cached_result(ws_id: str, kind: str, params: Dict, build, owned: bool) -> tuple:
+    """
+    Ejecuta build() -> (resultado, archivo_de_salida) o reutiliza el resultado
+    de una petición idéntica sobre el mismo workspace sin cambios.
+
+    Returns:
+        Tupla (resultado, reutilizado)
+    """
+    key = _result_key(ws_id, kind, params)
+    # build() puede actualizar el índice (y con él la versión): se registra con la clave posterior
+    return RESULTS.get_or_build(_index_store(ws_id), _ws_dir(ws_id), key, build, owned,
+                                key_after=lambda: _result_key(ws_id, kind, params))
+
+def _result_key(ws_id: str, kind: str, params: Dict) -> str:
+    return RESULTS.key(kind, params, _workspace_version(ws_id))
+
+def _merge_result(ws_id: str, out_name: str, total_pages: int) -> Dict:
+    return {
+        "ok": True,
+        "output": out_name,
+        "pages": total_pages,
+        "download_url": f"/workspaces/{ws_id}/download/{out_name}"
+    }
+
+def _stream_merge(ws_id: str, kind: str, params: Dict, output_name: str, assemble, save: bool,
+                  deduplicate: bool = False):
+    """
+    Respuesta en streaming de una unión: las páginas se juntan primero
+    (los errores 400/404 salen antes de empezar a enviar) y el PDF se
+    serializa directo a la respuesta. Con save=True se guarda además una
+    copia para /download y queda registrada en la caché de resultados;
+    si ya había un resultado idéntico se envía ese archivo.
+    """
+    ws_dir = _ws_dir(ws_id)
+    out_name = _safe_pdf_name(output_name)
+    store = _index_store(ws_id)
+    key = _result_key(ws_id, kind, params)
+    cached = RESULTS.lookup(store, ws_dir, key)
+    if cached is not None:
+        return FileResponse(ws_dir / out_name, media_type="application/pdf", filename=out_name,
+                            headers=_stream_headers(out_name, cached))
+
+    writer, total_pages = assemble()
+    result = _merge_result(ws_id, out_name, total_pages)
+    saved = deduplicate_objects(writer) if deduplicate else None
+    if saved is not None:
+        result["dedupe"] = {"bytes_saved": saved}
+    headers = _stream_headers(out_name, result)
+
+    def on_complete():
+        # El tamaño final sale de la copia guardada
+        if "dedupe" in result:
+            result["dedupe"]["bytes_after"] = (ws_dir / out_name).stat().st_size
+        RESULTS.register(store, ws_dir, key, out_name, result, owned=False)
+
+    return StreamingResponse(
+        stream_pdf_writer(writer, ws_dir / out_name if save else None, on_complete if save else None),
+        media_type="application/pdf",
+        headers=headers,
+    )
+
+def _stream_in_slot(kind: str, build: Callable[[], Response]) -> Response:
+    """
+    Ocupa un cupo del planificador mientras se arma la respuesta y, si es
+    streaming, hasta que se termina (o se corta) de enviar el cuerpo: el
+    PDF/ZIP se sigue generando después de que el handler devuelve.
+    """
+    _, release = SCHEDULER.acquire(kind)
+    try:
+        response = build()
+    except BaseException:
+        release()
+        raise
+    if not isinstance(response, StreamingResponse):
+        release()
+        return response
+
+    body = response.body_iterator
+
+    async def body_in_slot():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+
+    response.body_iterator = body_in_slot()
+    # Por si el cuerpo nunca llega a recorrerse (cliente desconectado antes)
+    tasks = BackgroundTasks()
+    if response.background is not None:
+        tasks.add_task(response.background)
+    tasks.add_task(release)
+    response.background = tasks
+    return response
+
+def _stream_headers(out_name: str, result: Dict) -> Dict[str, str]:
+    """Encabezados de una unión enviada en streaming (iguales si viene de la caché)."""
+    headers = {"Content-Disposition": content_disposition(out_name), "X-Total-Pages": str(result["pages"])}
+    if "dedupe" in result:
+        headers["X-Dedupe-Bytes-Saved"] = str(result["dedupe"]["bytes_saved"])
+    return headers
+
+def _jsonp_output(result: Dict) -> Optional[str]:
+    """Archivo generado por una orden JSONP exitosa (None si falló)."""
+    if not result.get("success"):
+        return None
+    return result["data"]["pdf_url"].rsplit("/", 1)[-1]
+
+def _with_output(result: Dict) -> tuple:
+    return result, _jsonp_output(result)
+
+def _job_response(job: Job, status_url: str) -> Dict:
+    """Respuesta inmediata al encolar un trabajo en segundo plano."""
+    return {"ok": True, "job_id": job.id, "state": job.state, "status_url": status_url}
 
 # ========= ENDPOINTS =========
 @app.get("/")
@@ -139,8 +638,10 @@ def serve_debug_page():
         raise HTTPException(status_code=404, detail="Página de debug no encontrada")
 
 @app.get("/health")
-def health():
-    return {"ok": True, "version": "2.0", "modules": ["filename", "content", "hybrid"]}
+async def health():
+    """Corre en el event loop (no en el pool de hilos): responde aunque el trabajo pesado lo llene."""
+    return {"ok": True, "version": "2.0", "modules": ["filename", "content", "hybrid"],
+            "scheduler": SCHEDULER.metrics(), "jobs_queued": JOBS.queued()}
 
 @app.post("/workspaces")
 def create_workspace():
@@ -152,27 +653,63 @@ def create_workspace():
 def list_workspaces():
     lst = []
     for d in STORAGE_DIR.iterdir():
-        if d.is_dir():
-            idx = _index_path(d.name)
-            lst.append({"workspace_id": d.name, "has_index": idx.exists()})
+        if d.is_dir() and not d.name.startswith("_"):
+            lst.append({"workspace_id": d.name, "has_index": _index_store(d.name).is_built()})
     return {"workspaces": lst}
 
 @app.post("/workspaces/{ws_id}/upload")
 async def upload_pdfs(ws_id: str, files: List[UploadFile] = File(...)):
+    """
+    Guarda los PDFs por contenido: el hash se calcula mientras se escribe y
+    cada contenido se almacena una sola vez en _blobs/, enlazado en el
+    workspace. Un PDF repetido (en este u otro workspace) no ocupa disco
+    extra y reutiliza el texto ya extraído (caché por hash).
+    Los códigos del nombre se devuelven de inmediato y el texto de cada
+    archivo se extrae en segundo plano, así /index solo termina el trabajo.
+    """
     up_dir = _uploads_dir(ws_id)
+    # SQLite (y una posible migración del índice antiguo) fuera del event loop
+    params = (await run_in_threadpool(lambda: _index_store(ws_id).meta()))["params"] or {}
+    prefetch = params.get("scan_mode", "both") != "filename"
+    max_pages = params.get("max_pages", 10000)
+    region = _params_region(params)
     saved = []
+    filename_codes = {}
+    deduplicated = 0
     for f in files:
         if not f.filename.lower().endswith(".pdf"):
             raise HTTPException(status_code=400, detail=f"Solo PDFs. Rechazado: {f.filename}")
         target = up_dir / _safe_pdf_name(f.filename)
-        async with aiofiles.open(target, "wb") as out:
-            while True:
-                chunk = await f.read(1024 * 1024)
-                if not chunk:
-                    break
-                await out.write(chunk)
+        tmp = BLOBS_DIR / f".upload-{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        try:
+            async with aiofiles.open(tmp, "wb") as out:
+                while True:
+                    chunk = await f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    await out.write(chunk)
+            blob = _blob_path(digest.hexdigest())
+            if blob.exists():
+                deduplicated += 1
+            else:
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, blob)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        _link_blob(blob, target)
+        READERS.invalidate(ws_id, target)
+        remember_sha256(target, digest.hexdigest())
         saved.append(target.name)
-    return {"saved": saved, "count": len(saved)}
+        filename_codes[target.name] = extract_codes_from_filename(target.name)
+        if prefetch:
+            PREFETCH.submit(ws_id, target, max_pages, region)
+    # Nuevos nombres: el mapa base -> partes se reconstruye en el próximo uso
+    await run_in_threadpool(lambda: _index_store(ws_id).clear_parts())
+    return {"saved": saved, "count": len(saved), "deduplicated": deduplicated,
+            "filename_codes": filename_codes, "extracting": PREFETCH.pending(ws_id)}
 
 @app.get("/workspaces/{ws_id}/files")
 def list_files(ws_id: str):
@@ -181,35 +718,27 @@ def list_files(ws_id: str):
     return {"files": files}
 
 @app.post("/workspaces/{ws_id}/index")
-def build_index(ws_id: str, req: IndexRequest):
+def build_index(ws_id: str, req: IndexRequest,
+                background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato.")):
     """
     Construye índice según scan_mode usando módulos especializados:
     - content: busca con regex dentro de páginas (TEXTO embebido)
     - filename: detecta códigos en el NOMBRE del archivo
     - both: combina ambas estrategias
+    La actualización es incremental: solo se escanean archivos nuevos o modificados.
+    Con background=true devuelve un job_id; el estado se consulta en /jobs/{job_id}.
     """
-    up_dir = _uploads_dir(ws_id)
-    files = sorted([p for p in up_dir.glob("*.pdf")], key=lambda p: p.name.lower())
-    if not files:
-        raise HTTPException(status_code=400, detail="No hay PDFs subidos.")
+    if background:
+        job = JOBS.submit("index", ws_id, lambda job: _build_index(ws_id, req, job),
+                          lambda result: f"/workspaces/{ws_id}/index")
+        return JSONResponse(_job_response(job, f"/jobs/{job.id}"), status_code=202)
+    with SCHEDULER.slot("index"):
+        return _build_index(ws_id, req)
 
-    index = {"by_code": {}, "files": [p.name for p in files]}
-    
+def _build_index(ws_id: str, req: IndexRequest, job: Optional[Job] = None) -> Dict:
     try:
-        # Usar módulos especializados según el modo seleccionado
-        if req.scan_mode == "filename":
-            by_code, debug_log = build_filename_index(files, req.max_pages)
-        elif req.scan_mode == "content":
-            by_code, debug_log = build_content_index(files, req.pattern, req.max_pages)
-        elif req.scan_mode == "both":
-            by_code, debug_log = build_hybrid_index(files, req.pattern, req.max_pages)
-        else:
-            raise HTTPException(status_code=400, detail=f"scan_mode no válido: {req.scan_mode}")
-        
-        index["by_code"] = by_code
-        
-        # Guardar el índice
-        _save_index(ws_id, index)
+        # Usar módulos especializados según el modo seleccionado (solo archivos nuevos/modificados)
+        store, debug_log, stats = _refresh_index(ws_id, req, job)
         
         # Opcional: guardar log de depuración
         log_path = _ws_dir(ws_id) / "debug_log.txt"
@@ -222,47 +751,92 @@ def build_index(ws_id: str, req: IndexRequest):
         return {
             "ok": True,
             "scan_mode": req.scan_mode,
-            "files_processed": len(files),
-            "total_files": len(files),
-            "codes_found": len(by_code),
-            "index_sample": dict(list(by_code.items())[:5]),
+            "files_processed": stats["scanned"],
+            "files_removed": stats["removed"],
+            "total_files": stats["total_files"],
+            "codes_found": store.code_count(),
+            "index_sample": store.sample(5),
             "debug_log": debug_log[:10]  # Primeras 10 líneas del log
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al construir el índice: {str(e)}")
 
 @app.get("/workspaces/{ws_id}/index")
 def get_index(ws_id: str):
-    return _load_index(ws_id)
+    """Exporta el índice completo (formato by_code/files) en streaming."""
+    return StreamingResponse(_index_store(ws_id).iter_export(), media_type="application/json")
 
 @app.post("/workspaces/{ws_id}/merge-by-code")
-def merge_by_code(ws_id: str, req: MergeByCodeRequest):
-    index = _load_index(ws_id)
-    by_code: Dict[str, List[Dict]] = index.get("by_code", {})
-    up_dir = _uploads_dir(ws_id)
+def merge_by_code(ws_id: str, req: MergeByCodeRequest,
+                  background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato."),
+                  stream: bool = Query(False, description="Enviar el PDF generado directamente en la respuesta."),
+                  save: bool = Query(True, description="Con stream=true, guardar también una copia para /download.")):
+    if background:
+        job = JOBS.submit("merge-by-code", ws_id, lambda job: _merge_by_code(ws_id, req, job),
+                          lambda result: result["download_url"])
+        return JSONResponse(_job_response(job, f"/jobs/{job.id}"), status_code=202)
+    if stream:
+        return _stream_in_slot("merge-by-code", lambda: _stream_merge(
+            ws_id, "merge-by-code", vars(req), req.output_name,
+            lambda: _assemble_merge_by_code(ws_id, req), save, req.deduplicate))
+    with SCHEDULER.slot("merge-by-code"):
+        return _merge_by_code(ws_id, req)
+
+def _merge_by_code(ws_id: str, req: MergeByCodeRequest, job: Optional[Job] = None) -> Dict:
+    """Une por código o reutiliza el PDF de una petición idéntica (ver _cached_result)."""
+    def build():
+        result = _write_merge_by_code(ws_id, req, job)
+        return result, result["output"]
+    result, reused = _cached_result(ws_id, "merge-by-code", vars(req), build, owned=False)
+    return {**result, "cached": reused}
+
+def _write_merge_by_code(ws_id: str, req: MergeByCodeRequest, job: Optional[Job] = None) -> Dict:
+    writer, total_pages = _assemble_merge_by_code(ws_id, req, job)
+    return _save_merge_by_code(ws_id, req, writer, total_pages)
+
+def _save_merge_by_code(ws_id: str, req: MergeByCodeRequest, writer: PdfWriter, total_pages: int) -> Dict:
+    saved = deduplicate_objects(writer) if req.deduplicate else None
     out_name = _safe_pdf_name(req.output_name)
     out_path = _ws_dir(ws_id) / out_name
+    with out_path.open("wb") as f:
+        writer.write(f)
+    result = _merge_result(ws_id, out_name, total_pages)
+    if saved is not None:
+        result["dedupe"] = {"bytes_saved": saved, "bytes_after": out_path.stat().st_size}
+    return result
 
-    writer = PdfWriter()
-    total_pages = 0
-
-    def add_page(file_name: str, page_idx: int):
-        nonlocal total_pages
-        src = up_dir / file_name
-        reader = PdfReader(str(src))
-        if 0 <= page_idx < len(reader.pages):
-            writer.add_page(reader.pages[page_idx])
-            total_pages += 1
+def _page_runs(steps: List[tuple]) -> List[tuple]:
+    """
+    Agrupa pasos (archivo, página | None) consecutivos en tramos
+    (archivo, inicio, fin) de páginas contiguas del mismo archivo, sin
+    cambiar el orden de salida. Un PDF completo es (archivo, 0, None).
+    """
+    runs: List[list] = []
+    for file_name, page_idx in steps:
+        if page_idx is None:
+            runs.append([file_name, 0, None])
+        elif runs and runs[-1][0] == file_name and runs[-1][2] == page_idx:
+            runs[-1][2] = page_idx + 1
+        else:
+            runs.append([file_name, page_idx, page_idx + 1])
+    return [tuple(run) for run in runs]
 
-    def add_entire_pdf(file_name: str):
-        nonlocal total_pages
-        src = up_dir / file_name
-        reader = PdfReader(str(src))
-        for p in reader.pages:
-            writer.add_page(p)
-            total_pages += 1
+def _assemble_merge_by_code(ws_id: str, req: MergeByCodeRequest, job: Optional[Job] = None,
+                            by_code: Optional[Dict[str, List[Dict]]] = None) -> tuple:
+    """
+    Junta en un PdfWriter las páginas de los códigos pedidos. Devuelve (writer, total_pages).
+    `by_code` son los hits ya consultados (p. ej. una sola vez para todo un lote).
+    """
+    if by_code is None:
+        # Búsqueda puntual de los códigos pedidos en el índice SQLite
+        by_code = _index_store(ws_id).lookup(req.order)
+    up_dir = _uploads_dir(ws_id)
 
+    # 1. Planificar: cada paso es (archivo, página) o (archivo, None) = PDF completo
+    steps = []
     for code in req.order:
         hits = by_code.get(code, [])
         if not hits:
@@ -280,51 +854,135 @@ def merge_by_code(ws_id: str, req: MergeByCodeRequest):
 
         # orden estable
         hits_sorted = sorted(hits, key=lambda h: (h.get("source",""), h["file"].lower(), h["page"]))
-
         if req.pages_per_code == "first":
-            h = hits_sorted[0]
+            hits_sorted = hits_sorted[:1]
+
+        for h in hits_sorted:
             if h.get("source") == "filename" and req.filename_behavior == "entire_pdf":
-                add_entire_pdf(h["file"])
+                steps.append((h["file"], None))
             else:
-                add_page(h["file"], h["page"])
-        else:  # "all"
-            for h in hits_sorted:
-                if h.get("source") == "filename" and req.filename_behavior == "entire_pdf":
-                    add_entire_pdf(h["file"])
-                else:
-                    add_page(h["file"], h["page"])
+                steps.append((h["file"], h["page"]))
+
+    # 2. Copiar cada tramo contiguo con una sola adquisición del lector
+    writer = PdfWriter()
+    total_pages = 0
+    for file_name, start, stop in _page_runs(steps):
+        with READERS.reader(up_dir / file_name, ws_id) as reader:
+            n_pages = len(reader.pages)
+            entire = stop is None
+            first, last = (0, n_pages) if entire else (max(start, 0), min(stop, n_pages))
+            for page_idx in range(first, last):
+                writer.add_page(reader.pages[page_idx])
+            copied = max(last - first, 0)
+        total_pages += copied
+        if job:
+            job.advance(files=1 if entire else 0, pages=copied)
 
     if total_pages == 0:
         raise HTTPException(status_code=400, detail="No se agregaron páginas. Revisa índice/filtros/orden.")
 
-    with out_path.open("wb") as f:
-        writer.write(f)
+    return writer, total_pages
+
+@app.post("/workspaces/{ws_id}/merge-by-code/batch")
+def merge_by_code_batch(ws_id: str, req: BatchMergeByCodeRequest,
+                        background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato.")):
+    """
+    Varias uniones por código sobre el mismo workspace en una sola llamada:
+    el índice se consulta una vez, los lectores abiertos se comparten entre
+    salidas y cada PDF se escribe apenas se arma (así no se acumulan en memoria).
+    """
+    if background:
+        job = JOBS.submit("merge-by-code-batch", ws_id, lambda job: _merge_by_code_batch(ws_id, req, job))
+        return JSONResponse(_job_response(job, f"/jobs/{job.id}"), status_code=202)
+    with SCHEDULER.slot("merge-by-code-batch"):
+        return _merge_by_code_batch(ws_id, req)
+
+def _merge_by_code_batch(ws_id: str, req: BatchMergeByCodeRequest, job: Optional[Job] = None) -> Dict:
+    if not req.merges:
+        raise HTTPException(status_code=400, detail="El lote no tiene uniones.")
+    names = [_safe_pdf_name(m.output_name).lower() for m in req.merges]
+    duplicated = sorted({n for n in names if names.count(n) > 1})
+    if duplicated:
+        raise HTTPException(status_code=400, detail=f"output_name repetido en el lote: {', '.join(duplicated)}")
+
+    store = _index_store(ws_id)
+    ws_dir = _ws_dir(ws_id)
+    version = _workspace_version(ws_id)
+    by_code = store.lookup({code for m in req.merges for code in m.order})
+    results: List[Optional[Dict]] = [None] * len(req.merges)
+
+    for i, merge in enumerate(req.merges):
+        key = RESULTS.key("merge-by-code", vars(merge), version)
+        cached = RESULTS.lookup(store, ws_dir, key)
+        if cached is not None:
+            results[i] = {**cached, "cached": True}
+            continue
+        try:
+            writer, total_pages = _assemble_merge_by_code(ws_id, merge, job, by_code)
+        except HTTPException as e:
+            results[i] = {"ok": False, "output": _safe_pdf_name(merge.output_name),
+                          "status_code": e.status_code, "error": e.detail}
+            continue
+        result = _save_merge_by_code(ws_id, merge, writer, total_pages)
+        RESULTS.register(store, ws_dir, key, result["output"], result, owned=False)
+        results[i] = {**result, "cached": False}
 
     return {
-        "ok": True,
-        "output": out_name,
-        "pages": total_pages,
-        "download_url": f"/workspaces/{ws_id}/download/{out_name}"
+        "ok": all(r["ok"] for r in results),
+        "total": len(results),
+        "results": results,
     }
 
 @app.post("/workspaces/{ws_id}/merge-by-bases")
-def merge_by_bases(ws_id: str, req: MergeByBaseRequest):
-    up_dir = _uploads_dir(ws_id)
+def merge_by_bases(ws_id: str, req: MergeByBaseRequest,
+                   background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato."),
+                   stream: bool = Query(False, description="Enviar el PDF generado directamente en la respuesta."),
+                   save: bool = Query(True, description="Con stream=true, guardar también una copia para /download.")):
+    if background:
+        job = JOBS.submit("merge-by-bases", ws_id, lambda job: _merge_by_bases(ws_id, req, job),
+                          lambda result: result["download_url"])
+        return JSONResponse(_job_response(job, f"/jobs/{job.id}"), status_code=202)
+    if stream:
+        return _stream_in_slot("merge-by-bases", lambda: _stream_merge(
+            ws_id, "merge-by-bases", vars(req), req.output_name,
+            lambda: _assemble_merge_by_bases(ws_id, req), save))
+    with SCHEDULER.slot("merge-by-bases"):
+        return _merge_by_bases(ws_id, req)
+
+def _merge_by_bases(ws_id: str, req: MergeByBaseRequest, job: Optional[Job] = None) -> Dict:
+    """Une por bases o reutiliza el PDF de una petición idéntica (ver _cached_result)."""
+    def build():
+        result = _write_merge_by_bases(ws_id, req, job)
+        return result, result["output"]
+    result, reused = _cached_result(ws_id, "merge-by-bases", vars(req), build, owned=False)
+    return {**result, "cached": reused}
+
+def _write_merge_by_bases(ws_id: str, req: MergeByBaseRequest, job: Optional[Job] = None) -> Dict:
+    writer, total_pages = _assemble_merge_by_bases(ws_id, req, job)
     out_name = _safe_pdf_name(req.output_name)
-    out_path = _ws_dir(ws_id) / out_name
+    with (_ws_dir(ws_id) / out_name).open("wb") as f:
+        writer.write(f)
+    return _merge_result(ws_id, out_name, total_pages)
+
+def _assemble_merge_by_bases(ws_id: str, req: MergeByBaseRequest, job: Optional[Job] = None) -> tuple:
+    """Junta en un PdfWriter las partes de cada base en orden. Devuelve (writer, total_pages)."""
+    up_dir = _uploads_dir(ws_id)
 
     writer = PdfWriter()
     total_pages = 0
 
     def add_pdf(path: Path):
         nonlocal total_pages
-        reader = PdfReader(str(path))
-        for p in reader.pages:
-            writer.add_page(p)
-            total_pages += 1
+        with READERS.reader(path, ws_id) as reader:
+            for p in reader.pages:
+                writer.add_page(p)
+                total_pages += 1
+            if job:
+                job.advance(files=1, pages=len(reader.pages))
 
+    parts_by_base = _parts_map(ws_id)
     for base in req.bases:
-        parts = _find_parts(base, up_dir)
+        parts = _find_parts(base, up_dir, parts_by_base)
         if not parts:
             simple = up_dir / f"{base}.pdf"
             if simple.exists():
@@ -336,22 +994,153 @@ def merge_by_bases(ws_id: str, req: MergeByBaseRequest):
     if total_pages == 0:
         raise HTTPException(status_code=400, detail="No se agregaron páginas (verifica 'bases' y archivos).")
 
-    with out_path.open("wb") as f:
+    return writer, total_pages
+
+@app.post("/workspaces/{ws_id}/split-by-code")
+def split_by_code(ws_id: str, req: SplitByCodeRequest,
+                  output: Literal["zip", "manifest"] = Query("zip", description="zip: descargar un ZIP; manifest: guardar los PDFs y listar sus URLs."),
+                  background: bool = Query(False, description="Con output=manifest, encolar como trabajo y devolver su id de inmediato.")):
+    """
+    Separa los PDFs fuente en un PDF por código según el índice (lo inverso
+    de merge-by-code). Cada fuente se recorre una sola vez con un único
+    lector y cada PDF de salida se escribe en cuanto está completo.
+    """
+    if output == "manifest":
+        if background:
+            job = JOBS.submit("split-by-code", ws_id, lambda job: _split_manifest(ws_id, req, job))
+            return JSONResponse(_job_response(job, f"/jobs/{job.id}"), status_code=202)
+        with SCHEDULER.slot("split-by-code"):
+            return _split_manifest(ws_id, req)
+
+    return _stream_in_slot("split-by-code", lambda: _split_zip(ws_id, req))
+
+def _split_zip(ws_id: str, req: SplitByCodeRequest) -> StreamingResponse:
+    """Separa en un directorio temporal y envía los PDFs en un ZIP (se borra al terminar)."""
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".split_", dir=_ws_dir(ws_id)))
+    try:
+        outputs = _split_by_code(ws_id, req, tmp_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    manifest = json.dumps({"workspace_id": ws_id, "outputs": outputs}, ensure_ascii=False, indent=2)
+
+    def body():
+        try:
+            entries = [(o["output"], tmp_dir / o["output"]) for o in outputs]
+            yield from iter_zip(entries + [("manifest.json", manifest.encode("utf-8"))])
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    zip_name = f"{req.output_prefix}separados_{ws_id}.zip"
+    return StreamingResponse(body(), media_type="application/zip",
+                             headers={"Content-Disposition": content_disposition(zip_name),
+                                      "X-Total-Outputs": str(len(outputs))},
+                             background=BackgroundTask(shutil.rmtree, tmp_dir, True))
+
+def _split_manifest(ws_id: str, req: SplitByCodeRequest, job: Optional[Job] = None) -> Dict:
+    outputs = _split_by_code(ws_id, req, _ws_dir(ws_id), job)
+    for o in outputs:
+        o["download_url"] = f"/workspaces/{ws_id}/download/{o['output']}"
+    return {"ok": True, "total_outputs": len(outputs), "outputs": outputs}
+
+def _plan_split(ws_id: str, req: SplitByCodeRequest) -> tuple:
+    """
+    Reparte los hits del índice por archivo fuente. Devuelve
+    ({archivo: [(página | None, código)]} en orden de archivo y página, códigos en orden).
+    """
+    by_code = _index_store(ws_id).lookup(req.codes)
+    wanted_files = {f.lower() for f in req.files} if req.files else None
+    by_file: Dict[str, List[tuple]] = {}
+    codes = []
+    for code, hits in by_code.items():
+        seen = set()
+        for h in hits:
+            if req.source_filter != "any" and h.get("source") != req.source_filter:
+                continue
+            if wanted_files is not None and h["file"].lower() not in wanted_files:
+                continue
+            page = None if h.get("source") == "filename" else h["page"]
+            if (h["file"], page) in seen:
+                continue
+            seen.add((h["file"], page))
+            by_file.setdefault(h["file"], []).append((page, code))
+        if seen:
+            codes.append(code)
+    if not codes:
+        raise HTTPException(status_code=400, detail="No hay códigos que separar. Revisa índice/filtros.")
+    # Dentro de cada fuente se avanza por número de página (el PDF completo primero)
+    order = {code: i for i, code in enumerate(codes)}
+    for steps in by_file.values():
+        steps.sort(key=lambda s: (-1 if s[0] is None else s[0], order[s[1]]))
+    return by_file, codes
+
+def _write_pdf(writer: PdfWriter, path: Path):
+    with path.open("wb") as f:
         writer.write(f)
 
-    return {
-        "ok": True,
-        "output": out_name,
-        "pages": total_pages,
-        "download_url": f"/workspaces/{ws_id}/download/{out_name}"
-    }
+def _split_by_code(ws_id: str, req: SplitByCodeRequest, out_dir: Path, job: Optional[Job] = None) -> List[Dict]:
+    """
+    Escribe en out_dir un PDF por código. Cada PDF se escribe (y se libera de
+    memoria) en cuanto se procesó la última fuente que le aporta páginas.
+    Devuelve el manifiesto (en orden de códigos).
+    """
+    by_file, codes = _plan_split(ws_id, req)
+    up_dir = _uploads_dir(ws_id)
+    last_file = {code: file_name for file_name, steps in by_file.items() for _, code in steps}
+    finishing: Dict[str, List[str]] = {}
+    for code, file_name in last_file.items():
+        finishing.setdefault(file_name, []).append(code)
+    writers: Dict[str, PdfWriter] = {}
+    info: Dict[str, Dict] = {}
+    if job:
+        job.set_total(files=len(by_file))
+
+    for file_name, steps in by_file.items():
+        copied = 0
+        with READERS.reader(up_dir / file_name, ws_id) as reader:
+            n_pages = len(reader.pages)
+            for page_idx, code in steps:
+                pages = range(n_pages) if page_idx is None else range(page_idx, min(page_idx + 1, n_pages))
+                if not pages:
+                    continue
+                writer = writers.setdefault(code, PdfWriter())
+                entry = info.setdefault(code, {"code": code, "pages": 0, "sources": []})
+                for i in pages:
+                    writer.add_page(reader.pages[i])
+                entry["pages"] += len(pages)
+                if file_name not in entry["sources"]:
+                    entry["sources"].append(file_name)
+                copied += len(pages)
+        if job:
+            job.advance(files=1, pages=copied)
+        for code in finishing.get(file_name, []):
+            if code not in writers:
+                continue
+            name = _safe_pdf_name(f"{req.output_prefix}{code}")
+            info[code]["output"] = name
+            _write_pdf(writers.pop(code), out_dir / name)
+
+    return [info[code] for code in codes if code in info]
 
 @app.get("/workspaces/{ws_id}/download/{filename}")
-def download(ws_id: str, filename: str):
+def download(ws_id: str, filename: str, request: Request):
+    """
+    Descarga con Range (reanudable), ETag fuerte (SHA-256 del archivo) y
+    304 para If-None-Match / If-Modified-Since. Los nombres de salida se
+    pueden reescribir, así que el cliente siempre revalida con el ETag.
+    """
     path = _ws_dir(ws_id) / filename
-    if not path.exists():
+    if not path.is_file():
         raise HTTPException(status_code=404, detail="Archivo no encontrado.")
-    return FileResponse(path, media_type="application/pdf", filename=filename)
+    return file_download_response(request, path, filename, file_sha256(path), media_type="application/pdf")
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Estado, progreso (archivos/páginas) y URL del resultado de un trabajo."""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    return job.to_dict()
 
 # ========= ENDPOINTS JSONP =========
 
@@ -379,26 +1168,86 @@ def create_workspace_jsonp(callback: str = Query(..., description="JSONP callbac
     
     return _jsonp_response(response_data, callback)
 
+@app.get("/jsonp/jobs/{job_id}")
+def get_job_jsonp(job_id: str, callback: str = Query(..., description="JSONP callback function")):
+    """Estado de un trabajo vía JSONP."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return _jsonp_response({"success": False, "error": "Trabajo no encontrado"}, callback)
+    return _jsonp_response({"success": True, "data": job.to_dict()}, callback)
+
+def _jsonp_heavy(kind: str, fn, callback: str):
+    """
+    Ejecuta fn() -> datos JSONP con un cupo de CPU. Sin cupo se responde el
+    error en JSONP (un <script> no puede leer el código HTTP) con retry_after
+    y el encabezado Retry-After.
+    """
+    try:
+        with SCHEDULER.slot(kind):
+            data = fn()
+    except HTTPException as e:
+        return _jsonp_busy(e, callback)
+    return _jsonp_response(data, callback)
+
+def _jsonp_busy(e: HTTPException, callback: str):
+    """Error 429/503 (con Retry-After) en JSONP; cualquier otro se relanza."""
+    retry_after = (e.headers or {}).get("Retry-After")
+    if retry_after is None:
+        raise e
+    response = _jsonp_response({"success": False, "error": e.detail, "retry_after": int(retry_after)}, callback)
+    response.headers["Retry-After"] = retry_after
+    return response
+
+def _jsonp_job(kind: str, workspace_id: str, fn, callback: str, result_url=None):
+    """Encola fn(job) -> datos JSONP y responde con el id del trabajo (o el 429 si la cola está llena)."""
+    try:
+        job = JOBS.submit(kind, workspace_id, fn,
+                          result_url or (lambda result: (result.get("data") or {}).get("pdf_url")))
+    except HTTPException as e:
+        return _jsonp_busy(e, callback)
+    return _jsonp_response({"success": True, **_job_response(job, f"/jsonp/jobs/{job.id}")}, callback)
+
 @app.get("/jsonp/workspaces/{workspace_id}/order-by-filename")
 def order_by_filename_jsonp(
     workspace_id: str, 
     callback: str = Query(..., description="JSONP callback function"),
-    order_list: str = Query("", description="Lista de bases separadas por comas")
+    order_list: str = Query("", description="Lista de bases separadas por comas"),
+    background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato")
 ):
     """Ordenar PDFs por nombre de archivo con orden específico vía JSONP"""
+    if background:
+        return _jsonp_job("order-by-filename", workspace_id,
+                          lambda job: _order_by_filename(workspace_id, order_list, job), callback)
+    return _jsonp_heavy("order-by-filename", lambda: _order_by_filename(workspace_id, order_list), callback)
+
+def _order_by_filename(workspace_id: str, order_list: str, job: Optional[Job] = None) -> Dict:
+    """Ordena por nombre; una petición repetida sin cambios reutiliza el PDF generado."""
+    try:
+        result, reused = _cached_result(
+            workspace_id, "order-by-filename", {"order_list": order_list},
+            lambda: _with_output(_build_order_by_filename(workspace_id, order_list, job)), owned=True)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+    if result.get("success"):
+        result["data"]["cached"] = reused
+    return result
+
+def _build_order_by_filename(workspace_id: str, order_list: str, job: Optional[Job] = None) -> Dict:
     try:
         ws_dir = _ws_dir(workspace_id)
         uploads_dir = _uploads_dir(workspace_id)
         
         if not uploads_dir.exists():
-            return _jsonp_response({"success": False, "error": "Workspace no encontrado"}, callback)
+            return {"success": False, "error": "Workspace no encontrado"}
         
         # Si no se especifica orden, procesar todos automáticamente
         if not order_list.strip():
-            return _process_all_files_by_name(workspace_id, uploads_dir, ws_dir, callback)
+            return _process_all_files_by_name(workspace_id, uploads_dir, ws_dir, job)
         
         # Procesar según orden específico
         bases_ordenadas = [base.strip() for base in order_list.split(',') if base.strip()]
+        if job:
+            job.set_total(files=len(bases_ordenadas))
         
         # Crear PDF unificado siguiendo el orden especificado
         pdf_writer = PdfWriter()
@@ -406,8 +1255,9 @@ def order_by_filename_jsonp(
         bases_procesadas = 0
         archivos_procesados = []
         
+        parts_by_base = _parts_map(workspace_id)
         for base in bases_ordenadas:
-            partes = _find_parts(base, uploads_dir)
+            partes = _find_parts(base, uploads_dir, parts_by_base)
             
             if not partes:
                 # Buscar archivo simple
@@ -421,16 +1271,18 @@ def order_by_filename_jsonp(
             bases_procesadas += 1
             for pdf_path in partes:
                 try:
-                    pdf_reader = PdfReader(pdf_path)
-                    for page in pdf_reader.pages:
-                        pdf_writer.add_page(page)
-                    total_pages += len(pdf_reader.pages)
+                    with READERS.reader(pdf_path, workspace_id) as pdf_reader:
+                        for page in pdf_reader.pages:
+                            pdf_writer.add_page(page)
+                        total_pages += len(pdf_reader.pages)
                     archivos_procesados.append(pdf_path.name)
+                    if job:
+                        job.advance(files=1, pages=len(pdf_reader.pages))
                 except Exception as e:
                     print(f"Error procesando {pdf_path.name}: {e}")
         
         if total_pages == 0:
-            return _jsonp_response({"success": False, "error": "No se encontraron archivos para las bases especificadas"}, callback)
+            return {"success": False, "error": "No se encontraron archivos para las bases especificadas"}
         
         # Guardar resultado con timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -453,28 +1305,52 @@ def order_by_filename_jsonp(
             }
         }
         
-        return _jsonp_response(response_data, callback)
+        return response_data
         
     except Exception as e:
-        return _jsonp_response({"success": False, "error": str(e)}, callback)
+        return {"success": False, "error": str(e)}
 
 @app.get("/jsonp/workspaces/{workspace_id}/order-by-content")
 def order_by_content_jsonp(
     workspace_id: str, 
     callback: str = Query(..., description="JSONP callback function"),
-    codigo_list: str = Query("", description="Lista de códigos separados por comas")
+    codigo_list: str = Query("", description="Lista de códigos separados por comas"),
+    search: Literal["auto", "index", "targeted"] = Query(
+        "auto", description="index: índice persistido; targeted: búsqueda dirigida con salida anticipada; auto: índice si está al día"),
+    background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato")
 ):
     """Ordenar PDFs por contenido con orden específico vía JSONP"""
+    if background:
+        return _jsonp_job("order-by-content", workspace_id,
+                          lambda job: _order_by_content(workspace_id, codigo_list, job, search), callback)
+    return _jsonp_heavy("order-by-content", lambda: _order_by_content(workspace_id, codigo_list, search=search),
+                        callback)
+
+def _order_by_content(workspace_id: str, codigo_list: str, job: Optional[Job] = None,
+                      search: str = "auto") -> Dict:
+    """Ordena por contenido; una petición repetida sin cambios reutiliza el PDF generado."""
+    try:
+        result, reused = _cached_result(
+            workspace_id, "order-by-content", {"codigo_list": codigo_list, "search": search},
+            lambda: _with_output(_build_order_by_content(workspace_id, codigo_list, job, search)), owned=True)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+    if result.get("success"):
+        result["data"]["cached"] = reused
+    return result
+
+def _build_order_by_content(workspace_id: str, codigo_list: str, job: Optional[Job] = None,
+                            search: str = "auto") -> Dict:
     try:
         ws_dir = _ws_dir(workspace_id)
         uploads_dir = _uploads_dir(workspace_id)
         
         if not uploads_dir.exists():
-            return _jsonp_response({"success": False, "error": "Workspace no encontrado"}, callback)
+            return {"success": False, "error": "Workspace no encontrado"}
         
         # Si no se especifica orden, hacer escaneo automático
         if not codigo_list.strip():
-            return _process_all_files_by_content(workspace_id, uploads_dir, ws_dir, callback)
+            return _process_all_files_by_content(workspace_id, uploads_dir, ws_dir, job)
         
         # Procesar según lista específica
         codigos_solicitados = []
@@ -488,61 +1364,30 @@ def order_by_content_jsonp(
                 codigos_solicitados.append(codigo_norm)
         
         if not codigos_solicitados:
-            return _jsonp_response({"success": False, "error": "No se especificaron códigos válidos"}, callback)
+            return {"success": False, "error": "No se especificaron códigos válidos"}
         
-        # Patrón genérico para cualquier código alfanumérico
-        CODE_REGEX = re.compile(r"\b[A-Za-z]{2,}[-_ ]?\d{1,}[A-Za-z0-9]*\b", re.IGNORECASE)
-        
-        # Indexar páginas por código
-        mapa_codigo_a_pagina = {}
-        pdf_files = list(uploads_dir.glob("*.pdf"))
-        
-        for pdf_path in pdf_files:
-            try:
-                reader = PdfReader(pdf_path)
-                
-                for page_idx in range(len(reader.pages)):
-                    try:
-                        text = reader.pages[page_idx].extract_text() or ""
-                    except Exception:
-                        text = ""
-                    
-                    # Buscar códigos en el texto
-                    for match in CODE_REGEX.finditer(text):
-                        codigo_raw = match.group(0)
-                        codigo = re.sub(r"[\s_-]", "", codigo_raw.upper())
-                        
-                        # Guardar primera ocurrencia por código
-                        if codigo not in mapa_codigo_a_pagina:
-                            mapa_codigo_a_pagina[codigo] = {
-                                "file": pdf_path.name,
-                                "page": page_idx,
-                                "reader": reader
-                            }
-                            break
-                
-            except Exception as e:
-                print(f"Error procesando {pdf_path.name}: {e}")
-        
-        # Seleccionar páginas según el listado
-        pdf_writer = PdfWriter()
-        paginas_agregadas = []
-        faltantes = []
+        # Resolver códigos: índice persistido (se construye/actualiza si hace falta) o,
+        # si no está al día y son pocos códigos, búsqueda dirigida con salida anticipada
+        if search == "auto":
+            usar_indice = _index_is_fresh(workspace_id) or len(codigos_solicitados) > TARGETED_SEARCH_MAX_CODES
+            search = "index" if usar_indice else "targeted"
+        pages_scanned = None
+        if search == "index":
+            ubicaciones = _first_content_pages(workspace_id, _content_hits(workspace_id, codigos_solicitados, job))
+        else:
+            ubicaciones, pages_scanned = _targeted_search(workspace_id, codigos_solicitados, job)
         
-        for codigo in codigos_solicitados:
-            if codigo in mapa_codigo_a_pagina:
-                info = mapa_codigo_a_pagina[codigo]
-                try:
-                    pdf_writer.add_page(info["reader"].pages[info["page"]])
-                    paginas_agregadas.append((codigo, info["page"] + 1))
-                except Exception as e:
-                    print(f"Error agregando página para código {codigo}: {e}")
-                    faltantes.append(codigo)
-            else:
-                faltantes.append(codigo)
+        # Seleccionar páginas según el listado: primero solo (archivo, página) por código...
+        encontrados = [c for c in codigos_solicitados if ubicaciones.get(c)]
+        # ...y luego se copian agrupadas por archivo, cada fuente abierta una sola vez
+        pdf_writer, fallidos = _copy_pages_in_order(
+            workspace_id, [(ubicaciones[c]["file"], ubicaciones[c]["page"]) for c in encontrados], job)
+        paginas_agregadas = [(c, ubicaciones[c]["page"] + 1) for i, c in enumerate(encontrados) if i not in fallidos]
+        agregados = {c for c, _ in paginas_agregadas}
+        faltantes = [c for c in codigos_solicitados if c not in agregados]
         
         if len(paginas_agregadas) == 0:
-            return _jsonp_response({"success": False, "error": f"No se encontraron códigos válidos. Faltantes: {', '.join(faltantes)}"}, callback)
+            return {"success": False, "error": f"No se encontraron códigos válidos. Faltantes: {', '.join(faltantes)}"}
         
         # Guardar resultado
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -562,18 +1407,22 @@ def order_by_content_jsonp(
                 "total_codigos": len(paginas_agregadas),
                 "total_pages": len(paginas_agregadas),
                 "timestamp": datetime.now().isoformat(),
-                "faltantes": faltantes if faltantes else None
+                "faltantes": faltantes if faltantes else None,
+                "search": search,
+                "pages_scanned": pages_scanned
             }
         }
         
-        return _jsonp_response(response_data, callback)
+        return response_data
         
     except Exception as e:
-        return _jsonp_response({"success": False, "error": str(e)}, callback)
+        return {"success": False, "error": str(e)}
 
-def _process_all_files_by_name(workspace_id: str, uploads_dir: Path, ws_dir: Path, callback: str):
+def _process_all_files_by_name(workspace_id: str, uploads_dir: Path, ws_dir: Path, job: Optional[Job] = None) -> Dict:
     """Procesar todos los archivos automáticamente por nombre"""
     pdf_files = list(uploads_dir.glob("*.pdf"))
+    if job:
+        job.set_total(files=len(pdf_files))
     
     # Lógica simple: ordenar alfabéticamente
     pdf_files.sort(key=lambda p: p.name.lower())
@@ -583,10 +1432,12 @@ def _process_all_files_by_name(workspace_id: str, uploads_dir: Path, ws_dir: Pat
     
     for pdf_path in pdf_files:
         try:
-            pdf_reader = PdfReader(pdf_path)
-            for page in pdf_reader.pages:
-                pdf_writer.add_page(page)
-            total_pages += len(pdf_reader.pages)
+            with READERS.reader(pdf_path, workspace_id) as pdf_reader:
+                for page in pdf_reader.pages:
+                    pdf_writer.add_page(page)
+                total_pages += len(pdf_reader.pages)
+            if job:
+                job.advance(files=1, pages=len(pdf_reader.pages))
         except Exception as e:
             print(f"Error procesando {pdf_path.name}: {e}")
     
@@ -609,46 +1460,16 @@ def _process_all_files_by_name(workspace_id: str, uploads_dir: Path, ws_dir: Pat
         }
     }
     
-    return _jsonp_response(response_data, callback)
+    return response_data
 
-def _process_all_files_by_content(workspace_id: str, uploads_dir: Path, ws_dir: Path, callback: str):
-    """Procesar todos los archivos automáticamente por contenido"""
-    CODE_REGEX = re.compile(r"\b[A-Za-z]{2,}[-_ ]?\d{1,}[A-Za-z0-9]*\b", re.IGNORECASE)
-    mapa_codigo_a_pagina = {}
-    pdf_files = list(uploads_dir.glob("*.pdf"))
+def _process_all_files_by_content(workspace_id: str, uploads_dir: Path, ws_dir: Path, job: Optional[Job] = None) -> Dict:
+    """Procesar todos los archivos automáticamente por contenido (vía índice persistido)"""
+    primeras = _first_content_pages(workspace_id, _content_hits(workspace_id, job=job))
     
-    for pdf_path in pdf_files:
-        try:
-            reader = PdfReader(pdf_path)
-            for page_idx in range(len(reader.pages)):
-                try:
-                    text = reader.pages[page_idx].extract_text() or ""
-                except Exception:
-                    text = ""
-                
-                for match in CODE_REGEX.finditer(text):
-                    codigo_raw = match.group(0)
-                    codigo = re.sub(r"[\s_-]", "", codigo_raw.upper())
-                    
-                    if codigo not in mapa_codigo_a_pagina:
-                        mapa_codigo_a_pagina[codigo] = {
-                            "file": pdf_path.name,
-                            "page": page_idx,
-                            "reader": reader
-                        }
-        except Exception as e:
-            print(f"Error procesando {pdf_path.name}: {e}")
-    
-    # Crear PDF unificado
-    pdf_writer = PdfWriter()
-    codigos_ordenados = sorted(mapa_codigo_a_pagina.keys())
-    
-    for codigo in codigos_ordenados:
-        info = mapa_codigo_a_pagina[codigo]
-        try:
-            pdf_writer.add_page(info["reader"].pages[info["page"]])
-        except Exception as e:
-            print(f"Error agregando página para código {codigo}: {e}")
+    # Crear PDF unificado (plan de (archivo, página) y copia agrupada por archivo)
+    codigos_ordenados = sorted(c for c, info in primeras.items() if info)
+    plan = [(primeras[c]["file"], primeras[c]["page"]) for c in codigos_ordenados]
+    pdf_writer, _ = _copy_pages_in_order(workspace_id, plan, job)
     
     # Guardar resultado
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -663,13 +1484,144 @@ def _process_all_files_by_content(workspace_id: str, uploads_dir: Path, ws_dir:
         "success": True,
         "data": {
             "pdf_url": pdf_url,
-            "total_codigos": len(mapa_codigo_a_pagina),
+            "total_codigos": len(codigos_ordenados),
             "total_pages": len(codigos_ordenados),
             "timestamp": datetime.now().isoformat()
         }
     }
     
-    return _jsonp_response(response_data, callback)
+    return response_data
+
+@app.get("/jsonp/workspaces/{workspace_id}/pdf-metadata")
+def pdf_metadata_jsonp(
+    workspace_id: str,
+    callback: str = Query(..., description="JSONP callback function"),
+    filename: str = Query("", description="PDF del workspace; vacío = todos los archivos subidos")
+):
+    """
+    Número de páginas y geometría por página (MediaBox, CropBox, rotación y
+    tamaño visible) vía JSONP. No decodifica contenido y se cachea por hash.
+    """
+    return _jsonp_heavy("pdf-metadata", lambda: _pdf_metadata(workspace_id, filename), callback)
+
+def _file_geometry(workspace_id: str, pdf_path: Path) -> Dict:
+    geometry = pdf_geometry(pdf_path, open_reader=lambda path: READERS.reader(path, workspace_id))
+    return {"filename": pdf_path.name, **geometry}
+
+def _pdf_metadata(workspace_id: str, filename: str) -> Dict:
+    try:
+        ws_path = STORAGE_DIR / workspace_id
+        uploads_dir = ws_path / "uploads"
+        if not uploads_dir.is_dir():
+            return {"success": False, "error": "Workspace no encontrado"}
+
+        if filename.strip():
+            pdf_path = uploads_dir / _safe_pdf_name(filename)
+            if not pdf_path.is_file():
+                return {"success": False, "error": f"Archivo no encontrado: {filename}"}
+            return {"success": True, **_file_geometry(workspace_id, pdf_path)}
+
+        # Forma por lotes: todos los PDFs del workspace en una sola llamada
+        files = []
+        for pdf_path in sorted(uploads_dir.glob("*.pdf")):
+            try:
+                files.append(_file_geometry(workspace_id, pdf_path))
+            except Exception as e:
+                files.append({"filename": pdf_path.name, "error": str(e)})
+        return {"success": True, "total_files": len(files), "files": files}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/jsonp/workspaces/{workspace_id}/resize-width")
+def resize_width_jsonp(
+    workspace_id: str,
+    callback: str = Query(..., description="JSONP callback function"),
+    target_width: float = Query(..., gt=0, description="Ancho final de las páginas en puntos PDF"),
+    filename: str = Query("", description="PDF del workspace; vacío = todos los archivos subidos"),
+    mode: str = Query("by_width", description="by_width: escala proporcional hasta el ancho pedido"),
+    background: bool = Query(False, description="Encolar como trabajo y devolver su id de inmediato")
+):
+    """
+    Lleva todas las páginas al mismo ancho escalando su contenido (sin
+    rasterizar). Las páginas que ya tienen ese ancho, según la geometría en
+    caché, se copian tal cual; varios archivos se procesan en paralelo.
+    """
+    if background:
+        return _jsonp_job("resize-width", workspace_id,
+                          lambda job: _resize_width(workspace_id, filename, target_width, mode, job), callback,
+                          result_url=lambda result: result.get("download_url"))
+    return _jsonp_heavy("resize-width", lambda: _resize_width(workspace_id, filename, target_width, mode), callback)
+
+def _resize_width(workspace_id: str, filename: str, target_width: float, mode: str,
+                  job: Optional[Job] = None) -> Dict:
+    try:
+        if mode != "by_width":
+            return {"success": False, "error": f"mode no válido: {mode}"}
+        uploads_dir = STORAGE_DIR / workspace_id / "uploads"
+        if not uploads_dir.is_dir():
+            return {"success": False, "error": "Workspace no encontrado"}
+
+        if filename.strip():
+            sources = [uploads_dir / _safe_pdf_name(filename)]
+            if not sources[0].is_file():
+                return {"success": False, "error": f"Archivo no encontrado: {filename}"}
+        else:
+            sources = sorted(uploads_dir.glob("*.pdf"))
+        if not sources:
+            return {"success": False, "error": "No hay PDFs en el workspace"}
+        if job:
+            job.set_total(files=len(sources))
+
+        ws_dir = _ws_dir(workspace_id)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        width_label = f"{target_width:g}".replace(".", "_")
+        files, tasks, task_files = [], [], []
+        for src in sources:
+            output_filename = f"{src.stem}_ancho{width_label}_{timestamp}.pdf"
+            info = {"filename": src.name, "output": output_filename,
+                    "download_url": f"/workspaces/{workspace_id}/download/{output_filename}"}
+            files.append(info)
+            try:
+                geometry = _file_geometry(workspace_id, src)
+            except Exception as e:
+                info["error"] = str(e)
+                continue
+            pages = [p["page"] - 1 for p in geometry["pages"] if needs_resize(p["width"], target_width)]
+            info.update(total_pages=geometry["page_count"], resized_pages=len(pages))
+            if pages:
+                tasks.append((str(src), str(ws_dir / output_filename), target_width, pages))
+                task_files.append(info)
+            else:
+                # Ya tiene el ancho pedido: la salida es una copia del original
+                shutil.copyfile(src, ws_dir / output_filename)
+
+        with SCHEDULER.extra_slots("resize-width", min(len(tasks), MAX_INDEX_WORKERS) - 1) as extra:
+            outcomes = resize_files(tasks, workers=1 + extra)
+        for info, outcome in zip(task_files, outcomes):
+            if isinstance(outcome, Exception):
+                info["error"] = str(outcome)
+            else:
+                info.update(outcome)
+        for info in files:
+            if "error" in info:
+                info.pop("download_url")
+        if job:
+            job.advance(files=len(sources))
+
+        ok = [info for info in files if "error" not in info]
+        response = {
+            "success": bool(ok),
+            "mode": mode,
+            "target_width": target_width,
+            "total_files": len(files),
+            "files": files,
+        }
+        if len(files) == 1:
+            # Un solo archivo: los datos también van en el nivel superior (así los lee el front)
+            response.update(files[0])
+        return response
+    except Exception as e:
+        return {"success": False, "error": str(e)}
 
 # ========= EJECUTAR SERVIDOR =========
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caché de resultados de uniones (merge-by-code, merge-by-bases y órdenes JSONP).
+La clave es un hash canónico del tipo de operación, sus parámetros y la
+versión del workspace (índice + archivos subidos): repetir la misma petición
+sin cambios devuelve el PDF ya generado en vez de reconstruirlo. Los
+registros viven en el índice SQLite del workspace y se desalojan por LRU
+cuando los PDFs cacheados superan el límite de tamaño por workspace.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from workspace_index_store import IndexStore
+
+# Peticiones idénticas simultáneas (doble clic) se serializan por clave
+_LOCK_STRIPES = 64
+
+
+class MergeResultCache:
+    """
+    Reutiliza PDFs de salida ya generados. Los archivos con nombre generado
+    (owned=True) se borran al desalojarlos; los que eligió el cliente solo se
+    olvidan para no romper enlaces de descarga.
+    """
+
+    def __init__(self, max_bytes_per_workspace: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes_per_workspace
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    @staticmethod
+    def key(kind: str, params: Dict, version: str) -> str:
+        """Hash canónico de (operación, parámetros, versión del workspace)."""
+        payload = json.dumps({"kind": kind, "params": params, "version": version},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_or_build(self, store: IndexStore, out_dir: Path, key: str,
+                     build: Callable[[], Tuple[Dict, Optional[str]]], owned: bool,
+                     key_after: Optional[Callable[[], str]] = None) -> Tuple[Dict, bool]:
+        """
+        Devuelve (resultado, reutilizado). `build()` genera el PDF y devuelve
+        (resultado, nombre_del_archivo_de_salida); un nombre None indica que
+        no hay nada que cachear (p. ej. una respuesta de error).
+        Si build() puede cambiar la versión del workspace (p. ej. actualiza el
+        índice), `key_after()` da la clave con la que se registra el resultado.
+        """
+        with self._locks[int(key[:8], 16) % _LOCK_STRIPES]:
+            cached = self.lookup(store, out_dir, key)
+            if cached is not None:
+                return cached, True
+
+            result, output = build()
+            if output is not None:
+                self.register(store, out_dir, key_after() if key_after else key, output, result, owned)
+            return result, False
+
+    def register(self, store: IndexStore, out_dir: Path, key: str, output: str, result: Dict, owned: bool):
+        """Registra un PDF ya escrito en out_dir/output como resultado de `key`."""
+        st = (out_dir / output).stat()
+        store.put_result(key, output, st.st_size, st.st_mtime_ns, owned, result, time.time())
+        self._evict(store, out_dir, keep=key)
+
+    def lookup(self, store: IndexStore, out_dir: Path, key: str) -> Optional[Dict]:
+        """Resultado cacheado de `key` si su archivo sigue intacto (None si no)."""
+        entry = store.get_result(key)
+        if entry is None:
+            return None
+        try:
+            st = (out_dir / entry["output"]).stat()
+        except OSError:
+            st = None
+        if st is None or st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+            # El archivo se borró o se sobrescribió: el registro ya no sirve
+            store.drop_result(key)
+            return None
+        store.touch_result(key, time.time())
+        return entry["result"]
+
+    def _evict(self, store: IndexStore, out_dir: Path, keep: str):
+        """Desaloja los resultados menos usados hasta quedar bajo el límite."""
+        entries = store.results_by_age()
+        total = sum(e["size"] for e in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry["key"] == keep:
+                continue
+            store.drop_result(entry["key"])
+            if entry["owned"]:
+                try:
+                    (out_dir / entry["output"]).unlink()
+                except OSError:
+                    pass
+            total -= entry["size"]
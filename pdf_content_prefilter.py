@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prefiltro barato para evitar extract_text() en páginas que no pueden tener
+códigos. Lee los bytes del content stream de la página:
+- sin operadores de texto (BT) ni formularios XObject: página sin capa de
+  texto (p. ej. escaneada), se descarta de inmediato
+- con fuentes simples: se decodifican los strings de los operadores de
+  texto y se prueba el patrón; si no aparece, no se extrae
+- con codificaciones propias (Type0, Type3, ToUnicode, Differences o
+  programas de fuente embebidos sin /Encoding) los bytes no son texto
+  legible, así que siempre se hace la extracción completa
+"""
+
+import re
+from typing import List
+
+from pypdf import PageObject
+from pypdf.generic import DictionaryObject
+
+# Veredictos del prefiltro
+PAGE_EMPTY = "empty"        # sin capa de texto: el texto es ""
+PAGE_NO_MATCH = "no_match"  # tiene texto pero el patrón no puede aparecer
+PAGE_EXTRACT = "extract"    # hay que extraer el texto completo
+
+_TEXT_BLOCK = re.compile(rb"(?<![A-Za-z0-9_])BT(?![A-Za-z0-9_])")
+_INLINE_IMAGE = re.compile(rb"(?<![A-Za-z0-9_])BI(?![A-Za-z0-9_])")
+_ESCAPES = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("f"): b"\f"}
+_OCTAL = b"01234567"
+_HEX = b"0123456789abcdefABCDEF"
+_FONT_PROGRAMS = ("/FontFile", "/FontFile2", "/FontFile3")
+
+
+def _has_custom_encoding(font: DictionaryObject) -> bool:
+    """True si los bytes de los strings no se pueden leer como texto latino."""
+    if font.get("/Subtype") in ("/Type0", "/Type3") or "/ToUnicode" in font:
+        return True
+    encoding = font.get("/Encoding")
+    if encoding is not None:
+        encoding = encoding.get_object()
+        return isinstance(encoding, DictionaryObject) and "/Differences" in encoding
+    # Sin /Encoding, una fuente embebida usa la codificación interna de su programa
+    descriptor = font.get("/FontDescriptor")
+    descriptor = descriptor.get_object() if descriptor is not None else {}
+    return any(key in descriptor for key in _FONT_PROGRAMS)
+
+
+def _resources_need_extraction(resources: DictionaryObject) -> bool:
+    """Formularios XObject (texto anidado) o fuentes con codificación propia."""
+    xobjects = resources.get("/XObject")
+    if xobjects is not None:
+        for xobj in xobjects.get_object().values():
+            if xobj.get_object().get("/Subtype") == "/Form":
+                return True
+    fonts = resources.get("/Font")
+    if fonts is not None:
+        for font in fonts.get_object().values():
+            if _has_custom_encoding(font.get_object()):
+                return True
+    return False
+
+
+def _literal_string(data: bytes, i: int) -> tuple:
+    """Decodifica un string literal que empieza en data[i] == '('; devuelve (bytes, fin)."""
+    out = bytearray()
+    depth = 1
+    i += 1
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5C:  # '\'
+            i += 1
+            if i >= n:
+                break
+            c = data[i]
+            if c in _ESCAPES:
+                out += _ESCAPES[c]
+            elif c in _OCTAL:
+                j = i
+                while j < n and j < i + 3 and data[j] in _OCTAL:
+                    j += 1
+                out.append(int(data[i:j], 8) & 0xFF)
+                i = j
+                continue
+            elif c in (0x0D, 0x0A):  # continuación de línea
+                if c == 0x0D and i + 1 < n and data[i + 1] == 0x0A:
+                    i += 1
+            else:
+                out.append(c)
+        elif c == 0x28:  # '('
+            depth += 1
+            out.append(c)
+        elif c == 0x29:  # ')'
+            depth -= 1
+            if depth == 0:
+                return bytes(out), i + 1
+            out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return bytes(out), n
+
+
+def _hex_string(data: bytes, i: int) -> tuple:
+    """Decodifica un string hexadecimal que empieza en data[i] == '<'; devuelve (bytes, fin)."""
+    end = data.find(b">", i + 1)
+    if end < 0:
+        end = len(data)
+    digits = bytes(c for c in data[i + 1:end] if c in _HEX)
+    if len(digits) % 2:
+        digits += b"0"
+    return bytes.fromhex(digits.decode("ascii")), end + 1
+
+
+def content_strings(data: bytes) -> List[str]:
+    """Strings (literales y hexadecimales) de un content stream, en orden."""
+    strings = []
+    i = 0
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x28:
+            raw, i = _literal_string(data, i)
+            strings.append(raw.decode("latin-1"))
+        elif c == 0x3C:
+            if i + 1 < n and data[i + 1] == 0x3C:  # '<<' diccionario
+                i += 2
+                continue
+            raw, i = _hex_string(data, i)
+            strings.append(raw.decode("latin-1"))
+        elif c == 0x25:  # comentario hasta fin de línea
+            while i < n and data[i] not in (0x0D, 0x0A):
+                i += 1
+        else:
+            i += 1
+    return strings
+
+
+def classify_page(page: PageObject, pattern: re.Pattern) -> str:
+    """
+    Decide si vale la pena extraer el texto de una página para `pattern`.
+    Ante cualquier duda (o error al leer el stream) devuelve PAGE_EXTRACT.
+    """
+    try:
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else DictionaryObject()
+        needs_extraction = _resources_need_extraction(resources)
+        contents = page.get_contents()
+        if contents is None:
+            return PAGE_EXTRACT if needs_extraction else PAGE_EMPTY
+        data = contents.get_data()
+        if needs_extraction or _INLINE_IMAGE.search(data):
+            # Un formulario puede tener texto aunque la página no tenga BT, y
+            # los datos binarios de una imagen en línea confunden al tokenizador
+            return PAGE_EXTRACT
+        if not _TEXT_BLOCK.search(data):
+            return PAGE_EMPTY
+        strings = content_strings(data)
+    except Exception:
+        return PAGE_EXTRACT
+
+    # extract_text() puede separar (o no) los fragmentos con espacios o saltos
+    # de línea; se prueban las tres uniones para no perder coincidencias
+    for sep in ("", " ", "\n"):
+        if pattern.search(sep.join(strings)):
+            return PAGE_EXTRACT
+    return PAGE_NO_MATCH
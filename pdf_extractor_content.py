@@ -7,10 +7,23 @@ Versión genérica que funciona con cualquier tipo de código.
 """
 
 import re
-from typing import List, Dict
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterator, List, Dict, Optional, Tuple, Union
 from pathlib import Path
 from pypdf import PdfReader
 
+from pdf_text_cache import PageTextCache, cache_key, file_sha256, get_text_cache
+from pdf_content_prefilter import PAGE_EMPTY, PAGE_EXTRACT, classify_page
+
+# En modo paralelo, los archivos grandes se reparten en rangos de este tamaño
+PAGES_PER_TASK = 100
+
+# Región de la página: (x0, y0, x1, y1) relativos al MediaBox (0-1), origen arriba-izquierda
+Region = Tuple[float, float, float, float]
+
 
 def extract_codes_from_text(text: str, pattern: re.Pattern) -> List[str]:
     """
@@ -26,21 +39,366 @@ def extract_codes_from_text(text: str, pattern: re.Pattern) -> List[str]:
     return list(dict.fromkeys(codes))  # únicos preservando orden
 
 
-def extract_codes_from_page(reader: PdfReader, page_idx: int, pattern: re.Pattern) -> List[str]:
+def extract_codes_from_page(reader: PdfReader, page_idx: int, pattern: re.Pattern,
+                            prefilter: bool = True) -> List[str]:
     """
     Extrae códigos alfanuméricos del TEXTO de una página específica.
     Manejo robusto de errores basado en el proyecto GUI funcional.
+    Con prefilter=True se omite la extracción si el content stream muestra
+    que el patrón no puede aparecer (ver pdf_content_prefilter).
+    """
+    text = _page_text(reader, page_idx, pattern if prefilter else None)
+    return extract_codes_from_text(text or "", pattern)
+
+
+def region_variant(region: Optional[Region]) -> str:
+    """Sufijo de caché para el texto de una región ("" = página completa)."""
+    if region is None:
+        return ""
+    return "roi-" + hashlib.sha1(json.dumps([round(v, 6) for v in region]).encode()).hexdigest()[:12]
+
+
+def _region_text(page, region: Region) -> str:
+    """
+    Texto de los operadores cuyo origen cae dentro de la región, recogido con
+    un visitor de extract_text() (la región se mide sobre el MediaBox).
+    """
+    box = page.mediabox
+    left, bottom = float(box.left), float(box.bottom)
+    width, height = float(box.width), float(box.height)
+    x0, x1 = left + region[0] * width, left + region[2] * width
+    y_top, y_bottom = bottom + (1 - region[1]) * height, bottom + (1 - region[3]) * height
+    parts = []
+    
+    def visit(text, cm, tm, font_dict, font_size):
+        # Posición en el espacio de la página: origen del texto (tm) transformado por la CTM
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        if x0 <= x <= x1 and y_bottom <= y <= y_top:
+            parts.append(text)
+    
+    page.extract_text(visitor_text=visit)
+    return "".join(parts)
+
+
+def _page_text(reader: PdfReader, page_idx: int, prefilter: Optional[re.Pattern] = None,
+               region: Optional[Region] = None) -> Optional[str]:
+    """
+    Texto de una página (o solo de `region`). Con `prefilter`, devuelve None
+    (sin extraer) si la página no puede contener el patrón; una página sin
+    capa de texto da "".
     """
     try:
-        text = reader.pages[page_idx].extract_text() or ""
+        page = reader.pages[page_idx]
+        if prefilter is not None:
+            verdict = classify_page(page, prefilter)
+            if verdict == PAGE_EMPTY:
+                return ""
+            if verdict != PAGE_EXTRACT:
+                return None
+        if region is not None:
+            return _region_text(page, region)
+        return page.extract_text() or ""
     except Exception:
         # Algunos PDFs fallan en extracción; continuar con texto vacío
-        text = ""
+        return ""
+
+
+class CachedPageTexts:
+    """
+    Acceso página a página al texto de un PDF a través de la caché por hash.
+    El PDF solo se abre si falta alguna página (o el total de páginas);
+    save() persiste lo extraído. Las páginas que el prefiltro descarta para
+    un patrón devuelven "" pero no se guardan (otro patrón podría aparecer).
+    Con `region` se guarda solo el texto de esa zona, en su propia entrada.
+    """
+    
+    def __init__(self, pdf_path: Path, cache: Optional[PageTextCache] = None,
+                 region: Optional[Region] = None):
+        self.pdf_path = pdf_path
+        self.cache = cache or get_text_cache()
+        self.region = region
+        self.digest = cache_key(file_sha256(pdf_path), region_variant(region))
+        self.entry = self.cache.load(self.digest)
+        self._reader: Optional[PdfReader] = None
+        self._dirty = False
+    
+    def _open(self) -> PdfReader:
+        if self._reader is None:
+            self._reader = PdfReader(str(self.pdf_path))
+        return self._reader
+    
+    @property
+    def page_count(self) -> int:
+        if self.entry["page_count"] is None:
+            self.entry["page_count"] = len(self._open().pages)
+            self._dirty = True
+        return self.entry["page_count"]
+    
+    def text(self, page_idx: int, prefilter: Optional[re.Pattern] = None) -> str:
+        text = self.entry["pages"].get(str(page_idx))
+        if text is None:
+            text = _page_text(self._open(), page_idx, prefilter, self.region)
+            if text is None:
+                return ""
+            self.entry["pages"][str(page_idx)] = text
+            self._dirty = True
+        return text
+    
+    def save(self):
+        if self._dirty:
+            self.cache.store(self.digest, self.entry)
+            self._dirty = False
+
+
+def extract_page_texts(pdf_path: Path, max_pages: int = 10000,
+                       cache: Optional[PageTextCache] = None,
+                       prefilter: Optional[re.Pattern] = None,
+                       region: Optional[Region] = None) -> Tuple[List[str], int]:
+    """
+    Devuelve el texto de las primeras `max_pages` páginas de un PDF.
+    Consulta primero la caché por hash de contenido; solo abre el PDF si
+    falta alguna página (o el número total de páginas).
+    Con `prefilter`, las páginas donde el patrón no puede aparecer se
+    devuelven como "" sin extraerlas; con `region`, solo el texto de esa zona.
+    
+    Returns:
+        Tupla (textos, total_de_paginas_del_archivo)
+    """
+    doc = CachedPageTexts(pdf_path, cache, region)
+    try:
+        texts = [doc.text(page_idx, prefilter) for page_idx in range(min(doc.page_count, max_pages))]
+    finally:
+        doc.save()
+    return texts, doc.page_count
+
+
+def normalize_code(code: str) -> str:
+    """Normalizar: mayúsculas, quitar espacios/guiones/guiones bajos."""
+    return re.sub(r"[\s_-]", "", code.upper())
+
+
+class MultiCodeMatcher:
+    """
+    Busca varios códigos concretos en una sola pasada: los compila en una
+    única regex alternada (autómata de la librería `re`) que acepta las mismas
+    variantes que la normalización (mayúsculas/minúsculas y un separador
+    '-', '_' o ' ' entre el prefijo de letras y los dígitos).
+    """
+    
+    def __init__(self, codes: List[str]):
+        self.codes = list(dict.fromkeys(normalize_code(c) for c in codes if normalize_code(c)))
+        alternatives = []
+        for code in sorted(self.codes, key=len, reverse=True):
+            m = re.match(r"^([A-Z]{2,})(\d.*)$", code)
+            if m:
+                alternatives.append(f"{re.escape(m.group(1))}[-_ ]?{re.escape(m.group(2))}")
+            else:
+                alternatives.append(re.escape(code))
+        self.pattern = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE) if alternatives else None
+    
+    def find(self, text: str) -> List[str]:
+        """Códigos pedidos (normalizados) presentes en el texto."""
+        if self.pattern is None:
+            return []
+        return list(dict.fromkeys(normalize_code(m.group(0)) for m in self.pattern.finditer(text)))
+
+
+def find_codes(files: List[Path], codes: List[str], max_pages: int = 10000,
+               progress: Optional[Callable[[int], None]] = None, prefilter: bool = True,
+               region: Optional[Region] = None) -> tuple:
+    """
+    Búsqueda dirigida: localiza la primera página (en orden de archivos y
+    páginas) de cada código pedido y se detiene en cuanto aparecen todos,
+    sin terminar de extraer el resto del lote. Con prefilter=True no se
+    extraen las páginas donde ninguno de los códigos puede aparecer; con
+    `region` solo se busca en esa zona de cada página.
+    
+    Returns:
+        Tupla (found, missing, pages_scanned) donde:
+        - found: {código: {"file", "page", "source": "content"}}
+        - missing: códigos no encontrados, en el orden pedido
+        - pages_scanned: páginas revisadas hasta la salida anticipada
+    """
+    matcher = MultiCodeMatcher(codes)
+    pending = set(matcher.codes)
+    page_filter = matcher.pattern if prefilter else None
+    found: Dict[str, Dict] = {}
+    pages_scanned = 0
+    
+    for pdf_path in files:
+        if not pending:
+            break
+        file_pages = 0
+        try:
+            doc = CachedPageTexts(pdf_path, region=region)
+            try:
+                for page_idx in range(min(doc.page_count, max_pages)):
+                    file_pages += 1
+                    for code in matcher.find(doc.text(page_idx, page_filter)):
+                        if code in pending:
+                            pending.discard(code)
+                            found[code] = {"file": pdf_path.name, "page": page_idx, "source": "content"}
+                    if not pending:
+                        break
+            finally:
+                doc.save()
+        except Exception as e:
+            print(f"Error procesando {pdf_path.name}: {e}")
+        pages_scanned += file_pages
+        if progress:
+            progress(file_pages)
     
-    return extract_codes_from_text(text, pattern)
+    missing = [c for c in matcher.codes if c not in found]
+    return found, missing, pages_scanned
 
 
-def build_content_index(files: List[Path], pattern_str: str, max_pages: int = 10000) -> tuple:
+def _extract_page_range(pdf_path: str, start: int, stop: int, prefilter: Optional[re.Pattern] = None,
+                        region: Optional[Region] = None) -> Tuple[int, List[Optional[str]]]:
+    """
+    Tarea de proceso: extrae el texto de las páginas [start, stop) de un PDF
+    (None para las que descarta el prefiltro); `stop` se recorta al final del
+    archivo. Devuelve (total_de_paginas, textos).
+    No toca la caché; el proceso principal guarda los resultados.
+    """
+    reader = PdfReader(pdf_path)
+    page_count = len(reader.pages)
+    return page_count, [_page_text(reader, page_idx, prefilter, region)
+                        for page_idx in range(start, min(stop, page_count))]
+
+
+def _missing_ranges(missing: List[int]) -> List[Tuple[int, int]]:
+    """Agrupa índices de página faltantes en rangos contiguos de hasta PAGES_PER_TASK."""
+    ranges = []
+    for page_idx in missing:
+        if ranges and ranges[-1][1] == page_idx and ranges[-1][1] - ranges[-1][0] < PAGES_PER_TASK:
+            ranges[-1] = (ranges[-1][0], page_idx + 1)
+        else:
+            ranges.append((page_idx, page_idx + 1))
+    return ranges
+
+
+def _extract_page_texts_parallel(files: List[Path], max_pages: int, workers: int, cache: PageTextCache,
+                                 prefilter: Optional[re.Pattern] = None,
+                                 region: Optional[Region] = None) -> Dict[Path, Union[Tuple[List[str], int], Exception]]:
+    """
+    Extrae el texto de varios PDFs repartiendo archivos y rangos de páginas
+    entre un ProcessPoolExecutor. Solo se extraen las páginas que faltan en la caché.
+    Si no se conoce el número de páginas de un archivo, la primera tarea lo
+    reporta y el resto de sus rangos se encola al recibirla (el proceso
+    principal nunca abre los PDFs). Solo se reescriben las entradas de caché
+    que ganaron páginas o su total.
+    """
+    results: Dict[Path, Union[Tuple[List[str], int], Exception]] = {}
+    pending = {}  # pdf_path -> [digest, entry]
+    dirty = set()
+    tasks = []    # (pdf_path, start, stop)
+    
+    def missing_tasks(pdf_path: Path, entry: Dict, skip: int = 0) -> List[Tuple[Path, int, int]]:
+        missing = [i for i in range(skip, min(entry["page_count"], max_pages)) if str(i) not in entry["pages"]]
+        return [(pdf_path, start, stop) for start, stop in _missing_ranges(missing)]
+    
+    for pdf_path in files:
+        try:
+            digest = cache_key(file_sha256(pdf_path), region_variant(region))
+            entry = cache.load(digest)
+            pending[pdf_path] = (digest, entry)
+            if entry["page_count"] is None:
+                # El trabajador reporta el total junto con el primer rango
+                tasks.append((pdf_path, 0, min(PAGES_PER_TASK, max_pages)))
+            else:
+                tasks.extend(missing_tasks(pdf_path, entry))
+        except Exception as e:
+            results[pdf_path] = e
+    
+    if tasks:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=ctx) as pool:
+            def submit(pdf_path: Path, start: int, stop: int):
+                future = pool.submit(_extract_page_range, str(pdf_path), start, stop, prefilter, region)
+                running[future] = (pdf_path, start, stop)
+            
+            running = {}
+            for task in tasks:
+                submit(*task)
+            while running:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    pdf_path, start, stop = running.pop(future)
+                    if pdf_path in results:
+                        continue
+                    try:
+                        page_count, texts = future.result()
+                    except Exception as e:
+                        results[pdf_path] = e
+                        continue
+                    entry = pending[pdf_path][1]
+                    if entry["page_count"] is None:
+                        entry["page_count"] = page_count
+                        dirty.add(pdf_path)
+                        for task in missing_tasks(pdf_path, entry, skip=stop):
+                            submit(*task)
+                    for offset, text in enumerate(texts):
+                        if text is not None:  # descartadas por el prefiltro: no se guardan
+                            entry["pages"][str(start + offset)] = text
+                            dirty.add(pdf_path)
+    
+    for pdf_path, (digest, entry) in pending.items():
+        if pdf_path in results:
+            continue
+        if pdf_path in dirty:
+            cache.store(digest, entry)
+        page_count = entry["page_count"]
+        pages = entry["pages"]
+        results[pdf_path] = ([pages.get(str(i), "") for i in range(min(page_count, max_pages))], page_count)
+    
+    return results
+
+
+def iter_page_texts(files: List[Path], max_pages: int = 10000, workers: int = 1,
+                    prefilter: Optional[re.Pattern] = None,
+                    region: Optional[Region] = None) -> Iterator[Tuple[Path, Union[Tuple[List[str], int], Exception]]]:
+    """
+    Recorre los archivos en orden y entrega (pdf_path, (textos, total_paginas))
+    o (pdf_path, excepción) si el archivo no pudo leerse.
+    Con workers > 1 la extracción se hace en paralelo, pero el orden de
+    entrega es siempre el de `files`. Con `prefilter` las páginas donde el
+    patrón no puede aparecer se entregan como ""; con `region` cada texto es
+    solo el de esa zona de la página.
+    """
+    cache = get_text_cache()
+    if workers > 1 and files:
+        results = _extract_page_texts_parallel(files, max_pages, workers, cache, prefilter, region)
+        for pdf_path in files:
+            yield pdf_path, results[pdf_path]
+        return
+    
+    for pdf_path in files:
+        try:
+            yield pdf_path, extract_page_texts(pdf_path, max_pages, cache, prefilter, region)
+        except Exception as e:
+            yield pdf_path, e
+
+
+def compile_content_pattern(pattern_str: str, debug_log: List[str]) -> re.Pattern:
+    """
+    Compila el patrón que llega del frontend; si no es válido se anota en
+    debug_log y se usa el patrón genérico por defecto.
+    """
+    try:
+        # Limpiar el patrón que viene del frontend (doble escape)
+        clean_pattern = pattern_str.replace('\\\\', '\\')
+        return re.compile(clean_pattern, flags=re.IGNORECASE)
+    except re.error as e:
+        debug_log.append(f"Error en patrón regex: {e}")
+        # Usar patrón por defecto genérico
+        debug_log.append("Usando patrón por defecto genérico para códigos alfanuméricos")
+        return re.compile(r"\b[A-Za-z]{2,}[-_ ]?\d{1,}[A-Za-z0-9]*\b", re.IGNORECASE)
+
+
+def build_content_index(files: List[Path], pattern_str: str, max_pages: int = 10000,
+                        workers: int = 1, progress: Optional[Callable[[int], None]] = None,
+                        prefilter: bool = False, region: Optional[Region] = None) -> tuple:
     """
     Construye un índice basado en contenido de PDFs.
     
@@ -48,6 +406,10 @@ def build_content_index(files: List[Path], pattern_str: str, max_pages: int = 10
         files: Lista de archivos PDF
         pattern_str: Patrón regex como string
         max_pages: Límite de páginas a escanear por archivo
+        workers: Procesos para extraer texto en paralelo (1 = secuencial)
+        progress: Se llama tras cada archivo con el número de páginas escaneadas
+        prefilter: Omitir la extracción de páginas donde el patrón no puede aparecer
+        region: Zona (x0, y0, x1, y1) relativa de la página donde buscar; None = toda
     
     Returns:
         Tupla (by_code, debug_log) donde:
@@ -57,33 +419,25 @@ def build_content_index(files: List[Path], pattern_str: str, max_pages: int = 10
     by_code = {}
     debug_log = []
     
-    # Compilar el patrón regex
-    try:
-        # Limpiar el patrón que viene del frontend (doble escape)
-        clean_pattern = pattern_str.replace('\\\\', '\\')
-        pattern = re.compile(clean_pattern, flags=re.IGNORECASE)
-    except re.error as e:
-        debug_log.append(f"Error en patrón regex: {e}")
-        # Usar patrón por defecto genérico
-        pattern = re.compile(r"\b[A-Za-z]{2,}[-_ ]?\d{1,}[A-Za-z0-9]*\b", re.IGNORECASE)
-        debug_log.append("Usando patrón por defecto genérico para códigos alfanuméricos")
+    pattern = compile_content_pattern(pattern_str, debug_log)
     
     files_processed = 0
     codes_found = 0
     
-    for pdf_path in files:
+    for pdf_path, extracted in iter_page_texts(files, max_pages, workers, pattern if prefilter else None, region):
         files_processed += 1
         file_codes = []
         
         try:
-            reader = PdfReader(str(pdf_path))
-            page_count = min(len(reader.pages), max_pages)
+            if isinstance(extracted, Exception):
+                raise extracted
+            page_texts, total_pages = extracted
             
-            debug_log.append(f"Procesando {pdf_path.name}: {len(reader.pages)} páginas total, escaneando {page_count}")
+            debug_log.append(f"Procesando {pdf_path.name}: {total_pages} páginas total, escaneando {len(page_texts)}")
             
-            for page_idx in range(page_count):
+            for page_idx, text in enumerate(page_texts):
                 try:
-                    codes = extract_codes_from_page(reader, page_idx, pattern)
+                    codes = extract_codes_from_text(text, pattern)
                     
                     for code in codes:
                         by_code.setdefault(code, []).append({
@@ -101,6 +455,9 @@ def build_content_index(files: List[Path], pattern_str: str, max_pages: int = 10
         except Exception as e:
             debug_log.append(f"Error procesando archivo {pdf_path.name}: {str(e)}")
         
+        if progress:
+            progress(0 if isinstance(extracted, Exception) else len(extracted[0]))
+        
         codes_found += len(file_codes)
         if file_codes:
             debug_log.append(f"Archivo {pdf_path.name}: {len(file_codes)} códigos encontrados en contenido")
@@ -7,7 +7,7 @@ Versión genérica que funciona con cualquier tipo de código.
 """
 
 import re
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 from pathlib import Path
 from pypdf import PdfReader
 
@@ -31,19 +31,22 @@ def extract_codes_from_filename(filename: str) -> List[str]:
     return list(dict.fromkeys(codes))  # únicos preservando orden
 
 
-def build_filename_index(files: List[Path], max_pages: int = 10000) -> Dict[str, List[Dict]]:
+def build_filename_index(files: List[Path], max_pages: int = 10000,
+                         progress: Optional[Callable[[int], None]] = None) -> Dict[str, List[Dict]]:
     """
     Construye un índice basado en nombres de archivo.
     
     Args:
         files: Lista de archivos PDF
         max_pages: Límite de páginas (no usado en este modo, pero mantenido por compatibilidad)
+        progress: Se llama tras cada archivo (con 0 páginas escaneadas)
     
     Returns:
         Diccionario con códigos como claves y lista de archivos como valores
     """
     by_code = {}
     debug_log = []
+    seen = set()  # (código, archivo) ya agregados
     
     for pdf_path in files:
         try:
@@ -53,7 +56,8 @@ def build_filename_index(files: List[Path], max_pages: int = 10000) -> Dict[str,
                 by_code.setdefault(code, [])
                 
                 # Evitar duplicados del mismo archivo
-                if not any(h["file"] == pdf_path.name for h in by_code[code]):
+                if (code, pdf_path.name) not in seen:
+                    seen.add((code, pdf_path.name))
                     by_code[code].append({
                         "file": pdf_path.name,
                         "page": 0,  # Marcador: se interpreta como archivo completo
@@ -65,6 +69,9 @@ def build_filename_index(files: List[Path], max_pages: int = 10000) -> Dict[str,
                 
         except Exception as e:
             debug_log.append(f"Error procesando nombre de archivo {pdf_path.name}: {str(e)}")
+        
+        if progress:
+            progress(0)
     
     return by_code, debug_log
 
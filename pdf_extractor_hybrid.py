@@ -6,65 +6,99 @@ Módulo separado para mantener el código organizado.
 Versión genérica que funciona con cualquier tipo de código.
 """
 
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Set, Tuple
 from pathlib import Path
-from pdf_extractor_filename import build_filename_index
-from pdf_extractor_content import build_content_index
+from pdf_extractor_filename import extract_codes_from_filename
+from pdf_extractor_content import compile_content_pattern, extract_codes_from_text, iter_page_texts
 
 
-def build_hybrid_index(files: List[Path], pattern_str: str, max_pages: int = 10000) -> tuple:
+def build_hybrid_index(files: List[Path], pattern_str: str, max_pages: int = 10000,
+                       workers: int = 1, progress: Optional[Callable[[int], None]] = None,
+                       prefilter: bool = False, region: Optional[Tuple[float, float, float, float]] = None) -> tuple:
     """
     Construye un índice combinando búsqueda por nombre de archivo y contenido.
+    Cada archivo se recorre una sola vez: primero su nombre y luego el texto
+    de sus páginas. El resultado es el mismo que unir ambos índices:
+    - por código, primero los hits de nombre y luego los de contenido
+    - de contenido solo la primera página de cada archivo, y ninguna si ese
+      archivo ya tiene el código en el nombre
+    - los códigos vistos en nombres van antes que los vistos solo en contenido
     
     Args:
         files: Lista de archivos PDF
         pattern_str: Patrón regex para búsqueda en contenido
         max_pages: Límite de páginas a escanear por archivo
+        workers: Procesos para extraer texto en paralelo (1 = secuencial)
+        progress: Se llama tras cada archivo con el número de páginas escaneadas
+        prefilter: Omitir la extracción de páginas donde el patrón no puede aparecer
+        region: Zona (x0, y0, x1, y1) relativa de la página donde buscar; None = toda
     
     Returns:
         Tupla (by_code, debug_log) donde:
         - by_code: Diccionario con códigos como claves
         - debug_log: Lista de mensajes de depuración
     """
-    debug_log = ["=== Modo híbrido: combinando filename + content ==="]
+    debug_log = ["=== Modo híbrido: nombre + contenido en una sola pasada ==="]
+    pattern = compile_content_pattern(pattern_str, debug_log)
     
-    # 1. Procesar nombres de archivo
-    debug_log.append("1. Procesando nombres de archivo...")
-    by_code_filename, log_filename = build_filename_index(files, max_pages)
-    debug_log.extend(log_filename)
+    by_code_filename: Dict[str, List[Dict]] = {}
+    by_code_content: Dict[str, List[Dict]] = {}
+    content_codes: Set[str] = set()          # todos los códigos vistos en contenido
+    seen: Set[Tuple[str, str]] = set()       # (código, archivo) ya agregados
     
-    # 2. Procesar contenido
-    debug_log.append("2. Procesando contenido de PDFs...")
-    by_code_content, log_content = build_content_index(files, pattern_str, max_pages)
-    debug_log.extend(log_content)
-    
-    # 3. Combinar resultados
-    debug_log.append("3. Combinando resultados...")
-    by_code_combined = {}
-    
-    # Primero agregar todos los resultados de filename
-    for code, entries in by_code_filename.items():
-        by_code_combined[code] = entries.copy()
+    for pdf_path, extracted in iter_page_texts(files, max_pages, workers, pattern if prefilter else None, region):
+        name = pdf_path.name
+        
+        # 1. Nombre del archivo
+        try:
+            codes_in_name = extract_codes_from_filename(name)
+            for code in codes_in_name:
+                if (code, name) not in seen:
+                    seen.add((code, name))
+                    by_code_filename.setdefault(code, []).append({"file": name, "page": 0, "source": "filename"})
+            if codes_in_name:
+                debug_log.append(f"Archivo {name}: {len(codes_in_name)} códigos encontrados en nombre")
+        except Exception as e:
+            debug_log.append(f"Error procesando nombre de archivo {name}: {str(e)}")
+        
+        # 2. Contenido (primera página por código y archivo)
+        file_codes: Set[str] = set()
+        try:
+            if isinstance(extracted, Exception):
+                raise extracted
+            page_texts, total_pages = extracted
+            debug_log.append(f"Procesando {name}: {total_pages} páginas total, escaneando {len(page_texts)}")
+            
+            for page_idx, text in enumerate(page_texts):
+                try:
+                    for code in extract_codes_from_text(text, pattern):
+                        file_codes.add(code)
+                        if (code, name) not in seen:
+                            seen.add((code, name))
+                            by_code_content.setdefault(code, []).append({"file": name, "page": page_idx, "source": "content"})
+                except Exception as e:
+                    debug_log.append(f"Error en página {page_idx+1} de {name}: {str(e)}")
+        except Exception as e:
+            debug_log.append(f"Error procesando archivo {name}: {str(e)}")
+        
+        content_codes.update(file_codes)
+        if file_codes:
+            debug_log.append(f"Archivo {name}: {len(file_codes)} códigos encontrados en contenido")
+        if progress:
+            progress(0 if isinstance(extracted, Exception) else len(extracted[0]))
     
-    # Luego agregar resultados de content, evitando duplicados del mismo archivo
-    for code, entries in by_code_content.items():
+    # Códigos de nombres primero (con sus hits de contenido detrás), luego los de solo contenido
+    by_code_combined = {code: hits + by_code_content.get(code, []) for code, hits in by_code_filename.items()}
+    for code, hits in by_code_content.items():
         if code not in by_code_combined:
-            by_code_combined[code] = []
-        
-        for entry in entries:
-            # Verificar si ya tenemos una entrada para este archivo
-            existing_files = [e["file"] for e in by_code_combined[code]]
-            if entry["file"] not in existing_files:
-                by_code_combined[code].append(entry)
+            by_code_combined[code] = hits
     
     # Estadísticas finales
     total_codes = len(by_code_combined)
-    filename_only = len(by_code_filename)
-    content_only = len(by_code_content)
     
     debug_log.append(f"Resumen: {total_codes} códigos únicos encontrados")
-    debug_log.append(f"  - Solo en nombres: {filename_only}")
-    debug_log.append(f"  - Solo en contenido: {content_only}")
+    debug_log.append(f"  - Solo en nombres: {len(by_code_filename)}")
+    debug_log.append(f"  - Solo en contenido: {len(content_codes)}")
     debug_log.append(f"  - Total combinado: {total_codes}")
     
     return by_code_combined, debug_log
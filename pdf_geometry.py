@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Geometría de las páginas de un PDF: número de páginas y, por página,
+MediaBox, CropBox, rotación y tamaño visible. Solo se leen los diccionarios
+del árbol de páginas (nunca se decodifican los content streams), y el
+resultado se guarda en caché por hash del archivo, igual que el texto.
+"""
+
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from pypdf import PageObject, PdfReader
+
+from pdf_text_cache import DEFAULT_CACHE_DIR, PageTextCache, file_sha256
+
+DEFAULT_GEOMETRY_CACHE_DIR = DEFAULT_CACHE_DIR.parent / "geometry"
+DEFAULT_GEOMETRY_MAX_BYTES = 64 * 1024 * 1024  # 64 MB
+
+# Precisión de las medidas devueltas (puntos PDF)
+_DECIMALS = 3
+
+
+def _box(box) -> List[float]:
+    return [round(float(v), _DECIMALS) for v in (box.left, box.bottom, box.right, box.top)]
+
+
+def _page_info(number: int, page: PageObject) -> Dict:
+    """Cajas y rotación de una página; width/height son los visibles (CropBox ya rotada)."""
+    mediabox = _box(page.mediabox)
+    cropbox = _box(page.cropbox)
+    rotation = page.rotation % 360
+    width = round(abs(cropbox[2] - cropbox[0]), _DECIMALS)
+    height = round(abs(cropbox[3] - cropbox[1]), _DECIMALS)
+    if rotation in (90, 270):
+        width, height = height, width
+    return {
+        "page": number,
+        "width": width,
+        "height": height,
+        "mediabox": mediabox,
+        "cropbox": cropbox,
+        "rotation": rotation,
+    }
+
+
+def read_geometry(reader: PdfReader) -> Dict:
+    """Geometría de todas las páginas de un PdfReader ya abierto."""
+    pages = [_page_info(i + 1, page) for i, page in enumerate(reader.pages)]
+    return {"page_count": len(pages), "pages": pages}
+
+
+@contextmanager
+def _open_reader(path: Path):
+    yield PdfReader(str(path))
+
+
+def pdf_geometry(pdf_path: Path, cache: Optional[PageTextCache] = None,
+                 open_reader: Optional[Callable[[Path], ContextManager[PdfReader]]] = None) -> Dict:
+    """
+    Geometría de `pdf_path` desde la caché por hash; si no está, se lee con
+    `open_reader(path)` (p. ej. el pool de lectores) y se guarda.
+    Devuelve {"page_count", "pages": [...], "cached": bool}.
+    """
+    cache = cache or get_geometry_cache()
+    digest = file_sha256(pdf_path)
+    entry = cache.load(digest)
+    if entry["page_count"] is not None:
+        return {"page_count": entry["page_count"], "pages": entry["pages"], "cached": True}
+
+    with (open_reader or _open_reader)(pdf_path) as reader:
+        geometry = read_geometry(reader)
+    cache.store(digest, geometry)
+    return {**geometry, "cached": False}
+
+
+_default_cache: Optional[PageTextCache] = None
+_default_lock = threading.Lock()
+
+
+def configure_geometry_cache(cache_dir: Path, max_bytes: int = DEFAULT_GEOMETRY_MAX_BYTES) -> PageTextCache:
+    """Define la caché de geometría compartida (ubicación y límite de tamaño)."""
+    global _default_cache
+    with _default_lock:
+        _default_cache = PageTextCache(cache_dir, max_bytes)
+    return _default_cache
+
+
+def get_geometry_cache() -> PageTextCache:
+    """Devuelve la caché de geometría compartida, creándola si hace falta."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = PageTextCache(DEFAULT_GEOMETRY_CACHE_DIR, DEFAULT_GEOMETRY_MAX_BYTES)
+        return _default_cache
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optimización de PDFs de salida antes de escribirlos.
+Al unir páginas de distintos archivos de un mismo lote cada página arrastra
+sus propias copias de fuentes, imágenes y XObjects; aquí se fusionan los
+objetos y streams idénticos para que el resultado los guarde una sola vez.
+"""
+
+from typing import Optional
+
+from pypdf import PdfWriter
+from pypdf.generic import StreamObject
+
+
+def deduplicate_objects(writer: PdfWriter) -> Optional[int]:
+    """
+    Fusiona objetos idénticos y descarta los huérfanos. Devuelve los bytes
+    ahorrados (estimados) o None si la versión de pypdf instalada no tiene
+    compress_identical_objects.
+    La estimación suma el largo de los streams que se eliminaron (fuentes,
+    imágenes...; los diccionarios sueltos pesan poco): medirlo de verdad
+    costaría una serialización completa extra y, en streaming, retrasaría
+    el primer byte.
+    """
+    if not hasattr(writer, "compress_identical_objects"):
+        return None
+    before = list(writer._objects)
+    writer.compress_identical_objects()
+    return sum(len(obj._data or b"") for i, obj in enumerate(before)
+               if isinstance(obj, StreamObject) and writer._objects[i] is None)
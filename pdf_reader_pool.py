@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pool compartido de PdfReader abiertos con desalojo LRU.
+Cada archivo fuente se parsea como mucho una vez mientras esté en el pool,
+así una unión que copia cientos de páginas del mismo PDF (o varias uniones
+seguidas) no vuelve a abrirlo página por página.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from pypdf import PdfReader
+
+# Estimación de memoria de un PdfReader parseado respecto al tamaño en disco
+READER_MEMORY_FACTOR = 3
+
+
+class _PooledReader:
+    def __init__(self, stamp: Tuple[int, int], cost: int):
+        self.stamp = stamp        # (mtime_ns, tamaño): si cambia, el archivo cambió
+        self.cost = cost          # memoria estimada en bytes
+        self.reader: Optional[PdfReader] = None
+        self.lock = threading.RLock()  # PdfReader no es seguro entre hilos
+
+
+class ReaderPool:
+    """
+    Pool LRU de lectores indexado por (workspace, archivo) y validado por mtime.
+    Se limita por número de lectores y por memoria estimada.
+    """
+
+    def __init__(self, max_readers: int = 32, max_bytes: int = 256 * 1024 * 1024):
+        self.max_readers = max_readers
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], _PooledReader]" = OrderedDict()
+        self._total_cost = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def reader(self, path: Path, workspace: str = "") -> Iterator[PdfReader]:
+        """
+        Presta el PdfReader de `path` con uso exclusivo mientras dure el bloque:
+            with pool.reader(path, ws_id) as reader:
+                writer.add_page(reader.pages[0])
+        """
+        st = path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        key = (workspace, str(path))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp != stamp:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                entry = _PooledReader(stamp, st.st_size * READER_MEMORY_FACTOR)
+                self._entries[key] = entry
+                self._total_cost += entry.cost
+                self._evict(keep=key)
+            else:
+                self._entries.move_to_end(key)
+
+        with entry.lock:
+            if entry.reader is None:
+                entry.reader = PdfReader(str(path))
+            yield entry.reader
+
+    def invalidate(self, workspace: str, path: Optional[Path] = None):
+        """Olvida los lectores de un archivo o de todo un workspace."""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == workspace and (path is None or key[1] == str(path)):
+                    self._drop(key)
+
+    def _drop(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key)
+        self._total_cost -= entry.cost
+
+    def _evict(self, keep: Tuple[str, str]):
+        """Desaloja los lectores menos usados (un lector en uso sigue vivo para quien lo tiene)."""
+        while (len(self._entries) > self.max_readers or self._total_cost > self.max_bytes) and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._drop(oldest)
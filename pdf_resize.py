@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Normalización del ancho de las páginas sin rasterizar.
+Cada página que no tiene el ancho pedido se escala con una matriz `cm`
+alrededor de su contenido y se escalan sus cajas (MediaBox, CropBox...) y
+anotaciones (coordenadas y apariencias). A diferencia de
+PageObject.scale_by(), el content stream no se parsea ni se reescribe: se
+envuelve entre dos streams nuevos ("q ... cm" y "Q"), así el costo por
+página no depende de cuánto contenido tenga.
+Varios archivos se procesan en paralelo en un pool de procesos.
+"""
+
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from pypdf import PageObject, PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, FloatObject, IndirectObject, NameObject, StreamObject
+
+# Diferencia de ancho (puntos) por debajo de la cual una página ya está "en el ancho"
+WIDTH_TOLERANCE = 0.5
+
+_BOXES = ("/MediaBox", "/CropBox", "/BleedBox", "/TrimBox", "/ArtBox")
+# Entradas de una anotación que son coordenadas de página (listas planas de números)
+_ANNOT_COORDS = ("/Rect", "/QuadPoints", "/Vertices", "/L", "/CL", "/RD")
+
+# (origen, destino, ancho_objetivo, páginas a escalar (índices 0-based) o None = calcularlas)
+ResizeTask = Tuple[str, str, float, Optional[List[int]]]
+
+
+def visible_width(page: PageObject) -> float:
+    """Ancho visible de la página: el de la CropBox, o su alto si está girada 90/270."""
+    box = page.cropbox
+    if page.rotation % 180:
+        return abs(float(box.height))
+    return abs(float(box.width))
+
+
+def needs_resize(width: float, target_width: float) -> bool:
+    return abs(width - target_width) >= WIDTH_TOLERANCE
+
+
+def _stream(writer: PdfWriter, data: bytes) -> IndirectObject:
+    stream = StreamObject()
+    stream.set_data(data)
+    return writer._add_object(stream)
+
+
+def _scale_numbers(array: ArrayObject, factor: float):
+    for i, value in enumerate(array):
+        if isinstance(value, (int, float)):
+            array[i] = FloatObject(float(value) * factor)
+
+
+def _scale_appearances(annot, factor: float, scaled_forms: Set[int]):
+    """
+    Escala las apariencias (/AP /N, /R, /D y sus estados) de una anotación.
+    La /BBox está en el espacio del formulario: se escala su /Matrix, así el
+    dibujo y su caja quedan en proporción con el /Rect ya escalado.
+    Un mismo stream compartido por varias anotaciones se escala una sola vez.
+    """
+    ap = annot.get("/AP")
+    if ap is None:
+        return
+    for entry in ap.get_object().values():
+        entry_obj = entry.get_object()
+        forms = [entry] if isinstance(entry_obj, StreamObject) else list(entry_obj.values())
+        for form in forms:
+            stream = form.get_object()
+            if not isinstance(stream, StreamObject) or id(stream) in scaled_forms:
+                continue
+            scaled_forms.add(id(stream))
+            matrix = stream.get("/Matrix")
+            values = [float(v) for v in matrix] if isinstance(matrix, ArrayObject) else [1, 0, 0, 1, 0, 0]
+            stream[NameObject("/Matrix")] = ArrayObject(FloatObject(v * factor) for v in values)
+
+
+def _scale_page(writer: PdfWriter, page: PageObject, factor: float,
+                wrappers: Dict[float, IndirectObject], restore: IndirectObject,
+                scaled_forms: Set[int]):
+    """Escala una página ya agregada a `writer` (no toca el PDF de origen)."""
+    contents = page.get("/Contents")
+    if contents is not None:
+        resolved = contents.get_object()
+        parts = list(resolved) if isinstance(resolved, ArrayObject) else [contents]
+        if factor not in wrappers:
+            wrappers[factor] = _stream(writer, f"q {factor:.6f} 0 0 {factor:.6f} 0 0 cm\n".encode("ascii"))
+        page[NameObject("/Contents")] = ArrayObject([wrappers[factor], *parts, restore])
+
+    for name in _BOXES:
+        if name in page or name == "/MediaBox":
+            box = page.mediabox if name == "/MediaBox" else page[name].get_object()
+            page[NameObject(name)] = ArrayObject(FloatObject(float(v) * factor) for v in box)
+
+    annots = page.get("/Annots")
+    if annots is not None:
+        for annot in annots.get_object():
+            annot = annot.get_object()
+            for name in _ANNOT_COORDS:
+                coords = annot.get(name)
+                coords = coords.get_object() if coords is not None else None
+                if isinstance(coords, ArrayObject):
+                    _scale_numbers(coords, factor)
+            ink = annot.get("/InkList")
+            ink = ink.get_object() if ink is not None else None
+            if isinstance(ink, ArrayObject):
+                for path in ink:
+                    path = path.get_object()
+                    if isinstance(path, ArrayObject):
+                        _scale_numbers(path, factor)
+            _scale_appearances(annot, factor, scaled_forms)
+
+
+def resize_pdf_width(src: str, dst: str, target_width: float,
+                     pages: Optional[Iterable[int]] = None) -> Dict:
+    """
+    Escribe en `dst` el PDF `src` con todas sus páginas al ancho
+    `target_width` (escala proporcional). `pages` son las páginas que hay que
+    escalar si ya se conocen (p. ej. por la geometría en caché); si es None
+    se revisan todas. Devuelve estadísticas de la operación.
+    """
+    reader = PdfReader(src)
+    writer = PdfWriter()
+    todo = set(pages) if pages is not None else None
+    wrappers: Dict[float, IndirectObject] = {}
+    scaled_forms: Set[int] = set()
+    restore = None
+    resized = 0
+
+    for idx, source_page in enumerate(reader.pages):
+        page = writer.add_page(source_page)
+        if todo is not None and idx not in todo:
+            continue
+        width = visible_width(page)
+        if width <= 0 or not needs_resize(width, target_width):
+            continue
+        if restore is None:
+            restore = _stream(writer, b"\nQ\n")
+        _scale_page(writer, page, target_width / width, wrappers, restore, scaled_forms)
+        resized += 1
+
+    tmp = Path(dst).with_name(f".{Path(dst).name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with tmp.open("wb") as f:
+            writer.write(f)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return {"total_pages": len(reader.pages), "resized_pages": resized}
+
+
+def resize_files(tasks: List[ResizeTask], workers: int = 1) -> List[Union[Dict, Exception]]:
+    """
+    Ejecuta varias tareas de redimensionado; con más de un archivo y
+    workers > 1 se reparten entre procesos. Devuelve, en el orden de
+    `tasks`, las estadísticas de cada archivo o la excepción que lo impidió.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        results: List[Union[Dict, Exception]] = []
+        for task in tasks:
+            try:
+                results.append(resize_pdf_width(*task))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=ctx) as pool:
+        futures = [pool.submit(resize_pdf_width, *task) for task in tasks]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
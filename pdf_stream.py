@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serialización de un PdfWriter en streaming.
+writer.write() corre en un hilo y escribe en una tubería acotada; quien
+consume recibe trozos a medida que se generan (p. ej. un StreamingResponse),
+así el primer byte sale antes de terminar el archivo y el PDF serializado
+nunca está entero en memoria. Opcionalmente se copia a disco al mismo tiempo.
+"""
+
+import os
+import queue
+import threading
+import uuid
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from pypdf import PdfWriter
+
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_QUEUE_CHUNKS = 16  # memoria máxima en tránsito = CHUNK_SIZE * QUEUE_CHUNKS
+
+_DONE = object()
+
+
+class _StreamAborted(Exception):
+    """El consumidor dejó de leer (p. ej. el cliente cerró la conexión)."""
+
+
+class _QueuePipe:
+    """Archivo de solo escritura que agrupa en trozos y los pasa a una cola acotada."""
+
+    def __init__(self, chunks: "queue.Queue", aborted: threading.Event, tee=None):
+        self._chunks = chunks
+        self._aborted = aborted
+        self._tee = tee
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def tell(self) -> int:
+        # pypdf usa tell() para calcular los offsets de la tabla xref
+        return self._position
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        if self._tee is not None:
+            self._tee.write(chunk)
+        self._put(chunk)
+
+    def _put(self, item):
+        while True:
+            if self._aborted.is_set():
+                raise _StreamAborted()
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def stream_pdf_writer(writer: PdfWriter, tee_path: Optional[Path] = None,
+                      on_complete: Optional[Callable[[], None]] = None) -> Iterator[bytes]:
+    """
+    Genera los bytes del PDF por trozos. Con `tee_path` también se guarda en
+    disco (vía archivo temporal; solo aparece si el PDF se completó) y luego
+    se llama a `on_complete()`.
+    """
+    chunks: "queue.Queue" = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    aborted = threading.Event()
+    tmp_path = tee_path.with_name(f".{tee_path.name}.{uuid.uuid4().hex[:8]}.tmp") if tee_path else None
+
+    def produce():
+        tee = tmp_path.open("wb") if tmp_path else None
+        pipe = _QueuePipe(chunks, aborted, tee)
+        try:
+            writer.write(pipe)
+            pipe.flush()
+            if tee is not None:
+                tee.close()
+                tee = None
+                os.replace(tmp_path, tee_path)
+                if on_complete:
+                    on_complete()
+            pipe._put(_DONE)
+        except _StreamAborted:
+            pass
+        except Exception as e:
+            try:
+                pipe._put(e)
+            except _StreamAborted:
+                pass
+        finally:
+            if tee is not None:
+                tee.close()
+            if tmp_path is not None and tmp_path.exists():
+                tmp_path.unlink()
+
+    thread = threading.Thread(target=produce, name="pdf-stream", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        aborted.set()
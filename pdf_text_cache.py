@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caché persistente del texto extraído de cada página de un PDF.
+Las entradas se direccionan por el hash SHA-256 del contenido del archivo,
+así que re-indexar con otro patrón (o re-ordenar) solo cuesta una pasada de
+regex sobre texto ya extraído. El tamaño en disco está limitado y se desaloja
+por LRU (la fecha de modificación de cada entrada marca su último uso).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+DEFAULT_CACHE_DIR = Path("./storage/_cache/text").resolve()
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+# Memo (ruta, tamaño, mtime) -> hash para no releer archivos que no cambiaron
+_HASH_MEMO_MAX = 10000
+_hash_memo: Dict[Tuple[str, int, int], str] = {}
+_hash_lock = threading.Lock()
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Devuelve el SHA-256 (hex) del contenido de un archivo.
+    Se memoriza por (ruta, tamaño, mtime) para no recalcularlo en cada llamada.
+    """
+    st = path.stat()
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        cached = _hash_memo.get(key)
+    if cached:
+        return cached
+
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _hash_lock:
+        if len(_hash_memo) >= _HASH_MEMO_MAX:
+            _hash_memo.clear()
+        _hash_memo[key] = digest
+    return digest
+
+
+def remember_sha256(path: Path, digest: str):
+    """Registra un hash ya calculado (p. ej. al subir el archivo) para no releerlo."""
+    st = path.stat()
+    with _hash_lock:
+        if len(_hash_memo) >= _HASH_MEMO_MAX:
+            _hash_memo.clear()
+        _hash_memo[(str(path), st.st_size, st.st_mtime_ns)] = digest
+
+
+def cache_key(digest: str, variant: str = "") -> str:
+    """
+    Clave de una entrada: el hash del PDF y, si el texto no es el de la página
+    completa (p. ej. solo una región), un sufijo que identifica la variante.
+    """
+    return f"{digest}-{variant}" if variant else digest
+
+
+class PageTextCache:
+    """
+    Caché en disco: un JSON por hash de PDF con el texto de sus páginas.
+
+    Formato de cada entrada:
+        {"page_count": int | None, "pages": {"0": "texto...", "1": "..."}}
+    """
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None  # se calcula perezosamente
+
+    def _entry_path(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.json"
+
+    def load(self, digest: str) -> Dict:
+        """Devuelve la entrada del hash (vacía si no existe) y la marca como usada."""
+        path = self._entry_path(digest)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"page_count": None, "pages": {}}
+        try:
+            os.utime(path)  # LRU: tocar la entrada al leerla
+        except OSError:
+            pass
+        entry.setdefault("page_count", None)
+        entry.setdefault("pages", {})
+        return entry
+
+    def store(self, digest: str, entry: Dict):
+        """Escribe la entrada de forma atómica y desaloja si se supera el límite."""
+        path = self._entry_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        old_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp, path)
+        new_size = path.stat().st_size
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += new_size - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self) -> int:
+        return sum(p.stat().st_size for p in self.cache_dir.glob("*/*.json"))
+
+    def _evict(self):
+        """Borra las entradas menos usadas hasta quedar en el 90% del límite."""
+        entries = []
+        for p in self.cache_dir.glob("*/*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, p))
+        entries.sort(key=lambda t: t[0])
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+
+_default_cache: Optional[PageTextCache] = None
+_default_lock = threading.Lock()
+
+
+def configure_text_cache(cache_dir: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> PageTextCache:
+    """Define la caché compartida (ubicación y límite de tamaño)."""
+    global _default_cache
+    with _default_lock:
+        _default_cache = PageTextCache(cache_dir, max_bytes)
+    return _default_cache
+
+
+def get_text_cache() -> PageTextCache:
+    """Devuelve la caché compartida, creándola con valores por defecto si hace falta."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = PageTextCache()
+        return _default_cache
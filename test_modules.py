@@ -3,13 +3,32 @@
 Script de prueba para los módulos de extracción de PDFs.
 """
 
+import io
+import json
+import re
+import shutil
 import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Importar módulos
 from pdf_extractor_filename import build_filename_index, extract_codes_from_filename
-from pdf_extractor_content import build_content_index
+from pdf_extractor_content import build_content_index, MultiCodeMatcher
 from pdf_extractor_hybrid import build_hybrid_index
+from http_download import _parse_range
+from workspace_index_store import IndexStore
+from work_scheduler import WorkScheduler
+from upload_pipeline import UploadPrefetcher
+from pdf_content_prefilter import PAGE_EMPTY, PAGE_EXTRACT, PAGE_NO_MATCH, classify_page, content_strings
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DictionaryObject, NameObject, StreamObject
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
 
 def test_filename_extraction():
     """Prueba la extracción de códigos desde nombres de archivo."""
@@ -28,6 +47,327 @@ def test_filename_extraction():
         codes = extract_codes_from_filename(filename)
         print(f"{filename:<25} -> {codes}")
 
+def test_multi_code_matcher():
+    """Prueba los límites de la búsqueda de varios códigos en una pasada."""
+    print("=== Prueba de búsqueda de varios códigos ===")
+    
+    matcher = MultiCodeMatcher(["MIA000043525230", "mia-123", "ABC12", "MIA123"])
+    assert matcher.codes == ["MIA000043525230", "MIA123", "ABC12"], matcher.codes
+    
+    cases = [
+        ("Codigo MIA000043525230.", ["MIA000043525230"]),  # puntuación alrededor
+        ("mia 123 y ABC12", ["MIA123", "ABC12"]),          # minúsculas y separador
+        ("mia_000043525230", ["MIA000043525230"]),         # guion bajo como separador
+        ("ABC-12", ["ABC12"]),
+        ("XMIA123", []),                                   # prefijo pegado: no es el código
+        ("MIA1234", []),                                   # código más largo
+        ("ABC123", []),
+        ("MIA000043525230ABC", []),                        # sufijo pegado
+        ("MIA123 MIA123", ["MIA123"]),                     # sin repetidos
+    ]
+    for text, expected in cases:
+        found = matcher.find(text)
+        print(f"{text!r:<28} -> {found}")
+        assert found == expected, (text, found)
+    
+    assert MultiCodeMatcher([]).find("MIA123") == []
+
+def test_index_store():
+    """Prueba el índice SQLite: escaneo completo, incremental e importación de index.json."""
+    print("=== Prueba del índice SQLite ===")
+    
+    fp = lambda n: {"size": n, "mtime_ns": n, "sha256": f"h{n}"}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = IndexStore(Path(tmp) / "index.sqlite3")
+        assert not store.is_built() and store.version() == 0 and store.lookup() == {}
+        
+        by_code = {
+            "MIA1": [{"file": "b.pdf", "page": 2, "source": "content"},
+                     {"file": "a.pdf", "page": 0, "source": "filename"}],
+            "MIA2": [{"file": "b.pdf", "page": 1, "source": "content"}],
+        }
+        version = store.apply_update(["a.pdf", "b.pdf"], {"a.pdf": fp(1), "b.pdf": fp(2)},
+                                     {"scan_mode": "both"}, by_code, full=True)
+        meta = store.meta()
+        print(f"versión {version}, archivos {meta['files']}, códigos {store.code_count()}")
+        assert version == 1 and store.is_built()
+        assert meta["params"] == {"scan_mode": "both"} and meta["fingerprints"]["b.pdf"] == fp(2)
+        # Primero el hit por nombre, luego por archivo y página
+        assert store.lookup(["MIA1"])["MIA1"] == [by_code["MIA1"][1], by_code["MIA1"][0]]
+        
+        # Incremental: b.pdf cambió y ya no tiene MIA2
+        version = store.apply_update(["a.pdf", "b.pdf"], {"a.pdf": fp(1), "b.pdf": fp(3)},
+                                     {"scan_mode": "both"},
+                                     {"MIA1": [{"file": "b.pdf", "page": 5, "source": "content"}]},
+                                     dropped=["b.pdf"])
+        hits = store.lookup()
+        print(f"versión {version}, índice {hits}")
+        assert version == 2 and list(hits) == ["MIA1"]
+        assert hits["MIA1"][1] == {"file": "b.pdf", "page": 5, "source": "content"}
+        
+        # index.json antiguo: sin huellas, se importa tal cual
+        legacy = IndexStore(Path(tmp) / "legacy.sqlite3")
+        legacy.import_legacy({"files": ["x.pdf"], "params": {"scan_mode": "content"},
+                              "by_code": {"MIA9": [{"file": "x.pdf", "page": 0, "source": "content"}]}})
+        meta = legacy.meta()
+        print(f"importado: {legacy.lookup()}")
+        assert legacy.lookup() == {"MIA9": [{"file": "x.pdf", "page": 0, "source": "content"}]}
+        assert meta["params"] == {"scan_mode": "content"} and meta["fingerprints"]["x.pdf"]["size"] == -1
+        
+        # Exportación recorrida desde varios hilos (como lo hace Starlette)
+        export = store.iter_export()
+        chunks = []
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            while True:
+                try:
+                    chunks.append(pool.submit(next, export).result())
+                except StopIteration:
+                    break
+        exported = json.loads("".join(chunks))
+        print(f"exportado desde varios hilos: {list(exported['by_code'])}")
+        assert exported["by_code"] == store.lookup() and exported["files"] == ["a.pdf", "b.pdf"]
+
+def _page_with_content(writer, data, font=None):
+    """Página con el content stream `data` y, si se indica, la fuente /F1."""
+    page = writer.add_blank_page(200, 200)
+    if data is not None:
+        stream = StreamObject()
+        stream.set_data(data)
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    if font is not None:
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): DictionaryObject(font)})})
+    return page
+
+def test_content_prefilter():
+    """Prueba los veredictos del prefiltro (sin capa de texto, sin coincidencia, extraer)."""
+    print("=== Prueba del prefiltro de contenido ===")
+    
+    pattern = re.compile(r"\bMIA[-_ ]?\d{3,}\b", re.IGNORECASE)
+    simple = {NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+              NameObject("/BaseFont"): NameObject("/Helvetica")}
+    type0 = {NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type0"),
+             NameObject("/BaseFont"): NameObject("/Custom")}
+    writer = PdfWriter()
+    cases = [
+        ("sin contenido", None, None, PAGE_EMPTY),
+        ("solo gráficos", b"0 0 m 100 100 l S", None, PAGE_EMPTY),
+        ("texto sin código", b"BT /F1 12 Tf 10 10 Td (Hola mundo) Tj ET", simple, PAGE_NO_MATCH),
+        ("código completo", b"BT /F1 12 Tf (Codigo MIA000555) Tj ET", simple, PAGE_EXTRACT),
+        ("código partido en TJ", b"BT /F1 12 Tf [(MIA0)-250(00)12(555)] TJ ET", simple, PAGE_EXTRACT),
+        ("código en hexadecimal", b"BT /F1 12 Tf <4D4941303035353535> Tj ET", simple, PAGE_EXTRACT),
+        ("escapes octales", b"BT /F1 12 Tf (\\115IA000555) Tj ET", simple, PAGE_EXTRACT),
+        ("codificación propia", b"BT /F1 12 Tf (xyz) Tj ET", type0, PAGE_EXTRACT),
+    ]
+    for label, data, font, expected in cases:
+        verdict = classify_page(_page_with_content(writer, data, font), pattern)
+        print(f"{label:<24} -> {verdict}")
+        assert verdict == expected, (label, verdict)
+    
+    assert content_strings(b"[(MIA0)-250(00\\)x)] TJ <4142> Tj") == ["MIA0", "00)x", "AB"]
+
+def _blank_pdf(*widths) -> bytes:
+    """PDF con una página en blanco por ancho (el ancho identifica la página)."""
+    writer = PdfWriter()
+    for width in widths or (200,):
+        writer.add_blank_page(width, 200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def test_parts_map():
+    """Prueba el mapa base -> partes (orden por N) y su reconstrucción tras una subida."""
+    print("=== Prueba del mapa de partes ===")
+    
+    ws_id = f"prueba_{uuid.uuid4().hex[:8]}"
+    try:
+        up_dir = main._uploads_dir(ws_id)
+        for name in ("A_1.pdf", "A_10.pdf", "A_0.pdf", "A_2.pdf", "b_0.pdf", "suelto.pdf", "A_x.pdf"):
+            (up_dir / name).write_bytes(_blank_pdf())
+        parts = main._parts_map(ws_id)
+        print(f"partes: {parts}")
+        assert parts == {"a": ["A_0.pdf", "A_1.pdf", "A_2.pdf", "A_10.pdf"], "b": ["b_0.pdf"]}
+        assert main._index_store(ws_id).parts_map(up_dir.stat().st_mtime_ns) == parts  # guardado
+        assert [p.name for p in main._find_parts("a", up_dir, parts)] == parts["a"]
+        
+        client = TestClient(main.app)
+        response = client.post(f"/workspaces/{ws_id}/upload",
+                               files=[("files", ("A_3.pdf", _blank_pdf(), "application/pdf"))])
+        assert response.status_code == 200
+        parts = main._parts_map(ws_id)
+        print(f"tras subir A_3.pdf: {parts['a']}")
+        assert parts["a"] == ["A_0.pdf", "A_1.pdf", "A_2.pdf", "A_3.pdf", "A_10.pdf"]
+    finally:
+        shutil.rmtree(main._ws_dir(ws_id), ignore_errors=True)
+
+def test_page_runs():
+    """Prueba la agrupación de pasos en tramos contiguos sin alterar el orden."""
+    print("=== Prueba de tramos de páginas ===")
+    
+    steps = [("a", 0), ("a", 1), ("a", 1), ("a", 2), ("b", None), ("b", 0),
+             ("a", 3), ("a", 5), ("a", 6), ("c", None), ("c", None)]
+    runs = main._page_runs(steps)
+    print(f"tramos: {runs}")
+    # Una página repetida abre un tramo nuevo; un PDF completo nunca se extiende
+    assert runs == [("a", 0, 2), ("a", 1, 3), ("b", 0, None), ("b", 0, 1),
+                    ("a", 3, 4), ("a", 5, 7), ("c", 0, None), ("c", 0, None)]
+    
+    # Expandir los tramos devuelve exactamente la secuencia original
+    expanded = []
+    for file_name, start, end in runs:
+        expanded.extend([(file_name, None)] if end is None
+                        else [(file_name, page) for page in range(start, end)])
+    assert expanded == steps
+    assert main._page_runs([]) == []
+
+def test_split_by_code():
+    """Prueba el orden de páginas y fuentes al separar por código desde varios PDFs."""
+    print("=== Prueba de separación por código ===")
+    
+    ws_id = f"prueba_{uuid.uuid4().hex[:8]}"
+    try:
+        up_dir = main._uploads_dir(ws_id)
+        # El ancho de cada página la identifica en la salida
+        sources = {"s1.pdf": (301, 302, 303), "s2.pdf": (311, 312), "MIAZ.pdf": (321, 322)}
+        for name, widths in sources.items():
+            (up_dir / name).write_bytes(_blank_pdf(*widths))
+        by_code = {
+            "MIAX": [{"file": "s1.pdf", "page": 2, "source": "content"},
+                     {"file": "s2.pdf", "page": 0, "source": "content"}],
+            "MIAY": [{"file": "s1.pdf", "page": 1, "source": "content"},
+                     {"file": "s1.pdf", "page": 0, "source": "content"}],
+            "MIAZ": [{"file": "s2.pdf", "page": 1, "source": "content"},
+                     {"file": "MIAZ.pdf", "page": 0, "source": "filename"}],
+        }
+        files = list(sources)
+        fingerprints = {name: {"size": 0, "mtime_ns": 0, "sha256": name} for name in files}
+        main._index_store(ws_id).apply_update(files, fingerprints, {"scan_mode": "both"}, by_code, full=True)
+        
+        by_file, codes = main._plan_split(ws_id, main.SplitByCodeRequest(source_filter="any"))
+        print(f"plan: {by_file}")
+        assert codes == ["MIAX", "MIAY", "MIAZ"]
+        # Dentro de cada fuente, por página (el PDF completo primero)
+        assert by_file == {"s1.pdf": [(0, "MIAY"), (1, "MIAY"), (2, "MIAX")],
+                           "s2.pdf": [(0, "MIAX"), (1, "MIAZ")],
+                           "MIAZ.pdf": [(None, "MIAZ")]}
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            out_dir = Path(tmp)
+            manifest = main._split_by_code(ws_id, main.SplitByCodeRequest(source_filter="any",
+                                                                         output_prefix="sep_"), out_dir)
+            print(f"manifiesto: {manifest}")
+            assert [m["code"] for m in manifest] == codes
+            assert [m["sources"] for m in manifest] == [["s1.pdf", "s2.pdf"], ["s1.pdf"], ["s2.pdf", "MIAZ.pdf"]]
+            widths = {m["code"]: [int(p.mediabox.width) for p in PdfReader(out_dir / m["output"]).pages]
+                      for m in manifest}
+            assert widths == {"MIAX": [303, 311], "MIAY": [301, 302], "MIAZ": [312, 321, 322]}
+            assert all(m["pages"] == len(widths[m["code"]]) for m in manifest)
+            
+            # Solo contenido: el PDF nombrado por el código no aporta páginas
+            manifest = main._split_by_code(ws_id, main.SplitByCodeRequest(codes=["MIAZ", "MIAX"]), out_dir)
+            assert [(m["code"], m["sources"]) for m in manifest] == [("MIAX", ["s1.pdf", "s2.pdf"]),
+                                                                     ("MIAZ", ["s2.pdf"])]
+    finally:
+        shutil.rmtree(main._ws_dir(ws_id), ignore_errors=True)
+
+def test_parse_range():
+    """Prueba la interpretación del encabezado Range de las descargas."""
+    print("=== Prueba de rangos de descarga ===")
+    
+    size = 1000
+    cases = [
+        ("bytes=0-99", (0, 99)),       # rango normal
+        ("bytes=-100", (900, 999)),    # sufijo: últimos 100 bytes
+        ("bytes=-5000", (0, 999)),     # sufijo más largo que el archivo
+        ("bytes=900-", (900, 999)),    # abierto hasta el final
+        ("bytes=990-5000", (990, 999)),  # fin recortado al tamaño
+        ("bytes=5-2", None),           # inválido: se ignora (200 completo)
+        ("bytes=abc", None),           # sintaxis no válida
+        ("bytes=0-1,5-6", None),       # varios rangos: archivo completo
+        ("items=0-1", None),           # otra unidad
+    ]
+    for header, expected in cases:
+        result = _parse_range(header, size)
+        print(f"{header:<18} -> {result}")
+        assert result == expected, (header, result)
+    
+    # Válidos pero imposibles de satisfacer: 416
+    for header in ("bytes=1000-", "bytes=2000-3000", "bytes=-0"):
+        try:
+            _parse_range(header, size)
+        except ValueError:
+            print(f"{header:<18} -> 416")
+        else:
+            raise AssertionError(f"{header} debería ser insatisfacible")
+
+def test_work_scheduler():
+    """Prueba el 429 con la cola llena, el 503 por espera agotada y release() idempotente."""
+    print("=== Prueba del planificador de trabajo ===")
+    
+    scheduler = WorkScheduler(max_concurrent=1, max_queued=1)
+    _, release = scheduler.acquire("pesado")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        def wait_turn():
+            try:
+                with scheduler.slot("espera", timeout=0.5):
+                    return 200
+            except HTTPException as e:
+                return e.status_code
+        
+        waiting = pool.submit(wait_turn)
+        deadline = time.monotonic() + 5
+        while scheduler.metrics()["waiting"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Cola llena: rechazo inmediato con Retry-After
+        try:
+            with scheduler.slot("rechazado"):
+                raise AssertionError("la cola llena debía rechazar con 429")
+        except HTTPException as e:
+            print(f"cola llena: {e.status_code}, Retry-After {e.headers['Retry-After']}")
+            assert e.status_code == 429 and int(e.headers["Retry-After"]) >= 1
+        assert waiting.result(timeout=5) == 503  # el cupo nunca se liberó a tiempo
+    
+    release()
+    release()  # la segunda llamada no libera un cupo ajeno
+    metrics = scheduler.metrics()
+    print(f"tras liberar: running={metrics['running']}, waiting={metrics['waiting']}")
+    assert metrics["running"] == 0 and metrics["waiting"] == 0
+    assert metrics["by_kind"]["rechazado"]["rejected"] == 1
+    assert metrics["by_kind"]["espera"]["timed_out"] == 1
+    
+    waited, release = scheduler.acquire("pesado", timeout=0.5)
+    assert waited < 0.5 and scheduler.metrics()["running"] == 1
+    release()
+    assert scheduler.metrics()["running"] == 0
+
+def test_prefetch_during_heavy_request():
+    """
+    Una subida que llega mientras una petición pesada tiene el único cupo de
+    CPU: la extracción adelantada no debe quedarse esperando ese cupo (antes
+    la petición esperaba a la extracción y ambas quedaban bloqueadas).
+    """
+    print("=== Prueba de extracción adelantada con el cupo ocupado ===")
+    
+    scheduler = WorkScheduler(max_concurrent=1)
+    prefetcher = UploadPrefetcher(scheduler=scheduler)
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = Path(tmp) / "subido.pdf"
+        writer = PdfWriter()
+        writer.add_blank_page(200, 200)
+        with pdf.open("wb") as f:
+            writer.write(f)
+        
+        with scheduler.slot("order-by-content"):
+            future = prefetcher.submit("ws", pdf)
+            future.result(timeout=5)  # antes: esperaba el cupo para siempre
+            metrics = scheduler.metrics()
+            print(f"con el cupo tomado: running={metrics['running']} waiting={metrics['waiting']}")
+            assert metrics["running"] == 1 and metrics["waiting"] == 0
+            assert prefetcher.cancel("ws") == 0  # ya terminó: nada que cancelar
+        
+        metrics = scheduler.metrics()
+        assert metrics["running"] == 0 and "upload-prefetch" not in metrics["by_kind"]
+
 def test_with_existing_pdfs():
     """Prueba con PDFs existentes en el storage."""
     storage_dir = Path("./storage")
@@ -63,4 +403,13 @@ def test_with_existing_pdfs():
 
 if __name__ == "__main__":
     test_filename_extraction()
+    test_multi_code_matcher()
+    test_index_store()
+    test_content_prefilter()
+    test_parts_map()
+    test_page_runs()
+    test_split_by_code()
+    test_parse_range()
+    test_work_scheduler()
+    test_prefetch_during_heavy_request()
     test_with_existing_pdfs()
\ No newline at end of file
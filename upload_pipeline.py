@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Etapa de extracción en segundo plano para archivos recién subidos.
+Cada PDF que termina de subirse se encola para extraer el texto de sus
+páginas a la caché por hash; cuando se llama a /index el escaneo de
+contenido ya solo aplica la regex sobre texto en caché. /index no espera a
+esta etapa: cancela lo que aún no empezó y extrae esas páginas él mismo.
+"""
+
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from pdf_extractor_content import extract_page_texts
+
+
+class UploadPrefetcher:
+    """
+    Extrae el texto de los PDFs subidos en un pool de hilos acotado y lleva
+    la cuenta de las extracciones en curso por (workspace, archivo).
+    """
+
+    def __init__(self, max_workers: int = 1, scheduler=None):
+        """
+        `scheduler` (WorkScheduler) es opcional: si se indica, cada
+        extracción ocupa un cupo de CPU libre y, si no lo hay, se omite (no
+        espera turno: /index extrae lo que falte).
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        self._scheduler = scheduler
+        self._futures: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, workspace: str, path: Path, max_pages: int = 10000,
+               region: Optional[Tuple[float, float, float, float]] = None) -> Future:
+        """
+        Encola la extracción de `path` (solo `region` si se indica, igual que
+        al indexar); si ya había una en curso para ese archivo, se suma otra.
+        """
+        key = (workspace, path.name)
+        future = self._executor.submit(self._extract, path, max_pages, region)
+        with self._lock:
+            self._futures[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def pending(self, workspace: str) -> int:
+        with self._lock:
+            return sum(1 for key in self._futures if key[0] == workspace)
+
+    def cancel(self, workspace: str) -> int:
+        """
+        Cancela las extracciones del workspace que aún no empezaron (p. ej.
+        porque /index va a escanear esos archivos) y devuelve cuántas. Nunca
+        espera a las que están en curso.
+        """
+        with self._lock:
+            futures = [f for key, f in self._futures.items() if key[0] == workspace]
+        return sum(1 for f in futures if f.cancel())
+
+    def _forget(self, key: Tuple[str, str], future: Future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def _extract(self, path: Path, max_pages: int, region: Optional[Tuple[float, float, float, float]]):
+        try:
+            if not path.exists():
+                return
+            if self._scheduler is None:
+                extract_page_texts(path, max_pages, region=region)
+                return
+            with self._scheduler.try_slot("upload-prefetch") as admitted:
+                if admitted:
+                    extract_page_texts(path, max_pages, region=region)
+        except Exception:
+            # Un PDF dañado se reporta igual al indexar; aquí solo se adelanta trabajo
+            traceback.print_exc()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Control de admisión para el trabajo pesado (indexar, unir, separar...).
+- Cupo global: como mucho `max_concurrent` tareas de CPU a la vez; el resto
+  espera su turno sin ocupar núcleos
+- Cola acotada: con `max_queued` peticiones ya esperando se responde 429, y
+  si el turno no llega en `queue_timeout` segundos, 503; ambos con Retry-After
+- Exclusión mutua por workspace para las escrituras del índice
+- Cupos adicionales (sin esperar) para las tareas que se reparten en procesos,
+  y cupos opcionales que se toman solo si están libres
+- Métricas de espera en cola por tipo de tarea
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Muestras de espera que se guardan por tipo para los percentiles
+_WAIT_SAMPLES = 256
+# Límites del Retry-After sugerido (segundos)
+_RETRY_MIN = 1
+_RETRY_MAX = 300
+
+
+class _KindStats:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0   # 429: cola llena
+        self.timed_out = 0  # 503: no hubo turno a tiempo
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    def to_dict(self) -> Dict:
+        waits = sorted(self.waits)
+
+        def pct(q: float) -> float:
+            return round(waits[min(int(len(waits) * q), len(waits) - 1)], 4) if waits else 0.0
+
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg_s": round(self.wait_total / self.admitted, 4) if self.admitted else 0.0,
+            "wait_p50_s": pct(0.5),
+            "wait_p95_s": pct(0.95),
+            "wait_max_s": round(self.wait_max, 4),
+        }
+
+
+class WorkScheduler:
+    """
+    Cupo global de tareas pesadas con cola acotada, más un candado por
+    workspace para las escrituras del índice.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int = 16, queue_timeout: float = 30.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._avg_run = 1.0  # duración media móvil de una tarea (para Retry-After)
+        self._stats: Dict[str, _KindStats] = {}
+        self._ws_locks: Dict[str, list] = {}  # workspace -> [candado, usuarios]
+        self._ws_guard = threading.Lock()
+
+    @contextmanager
+    def slot(self, kind: str, limit_queue: bool = True, timeout: Optional[float] = None) -> Iterator[float]:
+        """
+        Ocupa un cupo de CPU mientras dure el bloque y entrega los segundos
+        esperados. Con limit_queue=True (peticiones HTTP) se aplican el límite
+        de cola (429) y el tiempo máximo de espera (503); los trabajos en
+        segundo plano usan limit_queue=False y esperan lo que haga falta.
+        """
+        waited, release = self.acquire(kind, limit_queue, timeout)
+        try:
+            yield waited
+        finally:
+            release()
+
+    def acquire(self, kind: str, limit_queue: bool = True,
+                timeout: Optional[float] = None) -> Tuple[float, Callable[[], None]]:
+        """
+        Igual que slot() pero sin bloque: devuelve (segundos esperados,
+        release). Sirve cuando el trabajo sigue después de que el handler
+        devuelve la respuesta (streaming). release() se puede llamar varias
+        veces; solo la primera libera el cupo.
+        """
+        start = time.monotonic()
+        with self._cond:
+            stats = self._stats.setdefault(kind, _KindStats())
+            if self._running >= self.max_concurrent:
+                if limit_queue and self._waiting >= self.max_queued:
+                    stats.rejected += 1
+                    raise self._busy(429, "Demasiadas tareas en cola, intenta más tarde.")
+                wait_limit = (timeout if timeout is not None else self.queue_timeout) if limit_queue else None
+                self._waiting += 1
+                try:
+                    while self._running >= self.max_concurrent:
+                        remaining = None if wait_limit is None else wait_limit - (time.monotonic() - start)
+                        if remaining is not None and remaining <= 0:
+                            stats.timed_out += 1
+                            raise self._busy(503, "Servidor ocupado, intenta más tarde.")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._running += 1
+            waited = time.monotonic() - start
+            stats.admitted += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            stats.waits.append(waited)
+        return waited, self._releaser()
+
+    @contextmanager
+    def try_slot(self, kind: str) -> Iterator[bool]:
+        """
+        Ocupa un cupo solo si hay uno libre y nadie espera turno; nunca
+        espera. Entrega True si lo obtuvo. Es para trabajo opcional (p. ej.
+        adelantar la extracción de una subida): no puede quedar bloqueado
+        detrás de una petición que a su vez lo esté esperando.
+        """
+        with self._cond:
+            free = self._running < self.max_concurrent and self._waiting == 0
+            if free:
+                self._running += 1
+                stats = self._stats.setdefault(kind, _KindStats())
+                stats.admitted += 1
+                stats.waits.append(0.0)
+        release = self._releaser() if free else None
+        try:
+            yield free
+        finally:
+            if release is not None:
+                release()
+
+    def _releaser(self) -> Callable[[], None]:
+        """release() de un cupo recién ocupado; solo la primera llamada lo libera."""
+        started = time.monotonic()
+        released = []
+
+        def release():
+            with self._cond:
+                if released:
+                    return
+                released.append(True)
+                self._running -= 1
+                self._avg_run = 0.8 * self._avg_run + 0.2 * (time.monotonic() - started)
+                self._cond.notify()
+
+        return release
+
+    @contextmanager
+    def extra_slots(self, kind: str, wanted: int) -> Iterator[int]:
+        """
+        Para una tarea que ya tiene su cupo y quiere repartirse en varios
+        procesos: toma, sin esperar, hasta `wanted` cupos libres más y entrega
+        cuántos obtuvo (0 si no hay). Así un pool de procesos nunca usa más
+        núcleos que los que el planificador tiene libres.
+        """
+        with self._cond:
+            extra = max(0, min(wanted, self.max_concurrent - self._running))
+            self._running += extra
+        try:
+            yield extra
+        finally:
+            if extra:
+                with self._cond:
+                    self._running -= extra
+                    self._cond.notify(extra)
+
+    def retry_after(self, pending: int = 0) -> int:
+        """Segundos sugeridos para reintentar, según la cola y la duración media."""
+        turns = (self._waiting + pending + 1) / self.max_concurrent
+        return min(max(math.ceil(self._avg_run * turns), _RETRY_MIN), _RETRY_MAX)
+
+    def _busy(self, status_code: int, detail: str) -> HTTPException:
+        """Error 429/503 con el Retry-After estimado."""
+        return HTTPException(status_code=status_code, detail=detail,
+                             headers={"Retry-After": str(self.retry_after())})
+
+    @contextmanager
+    def workspace_lock(self, workspace: str) -> Iterator[None]:
+        """Exclusión mutua (reentrante) por workspace, p. ej. dos /index simultáneos."""
+        with self._ws_guard:
+            entry = self._ws_locks.setdefault(workspace, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._ws_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._ws_locks[workspace]
+
+    def metrics(self) -> Dict:
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "queue_timeout_s": self.queue_timeout,
+                "avg_run_s": round(self._avg_run, 4),
+                "by_kind": {kind: stats.to_dict() for kind, stats in sorted(self._stats.items())},
+            }
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Índice de un workspace guardado en SQLite (reemplaza al index.json monolítico).
+Tablas para archivos (con su huella), códigos y hits, con búsqueda puntual
+por código e inserciones masivas al indexar. La exportación completa con el
+formato antiguo ({"by_code": ..., "files": ...}) se genera en streaming.
+También guarda el mapa base -> partes (base_0.pdf, base_1.pdf, ...) de uploads/
+y el registro de resultados de uniones ya generados (caché de resultados).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    name     TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS codes (
+    code TEXT PRIMARY KEY,
+    seq  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hits (
+    code   TEXT NOT NULL,
+    file   TEXT NOT NULL,
+    page   INTEGER NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hits_by_code ON hits (code);
+CREATE INDEX IF NOT EXISTS hits_by_file ON hits (file);
+CREATE TABLE IF NOT EXISTS parts (
+    base TEXT NOT NULL,
+    idx  INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key       TEXT PRIMARY KEY,
+    output    TEXT NOT NULL,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL,
+    owned     INTEGER NOT NULL,
+    result    TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+# Orden de los hits de un código: primero por nombre, luego por archivo y página
+_HITS_ORDER = "h.source != 'filename', f.position, h.page"
+
+# SQLite limita el número de parámetros por consulta
+_IN_CHUNK = 500
+
+# Bases ya preparadas (esquema + WAL) por (ruta, inodo): se hace una vez por archivo
+_prepared = set()
+_prepared_lock = threading.Lock()
+
+
+class IndexStore:
+    """Índice SQLite de un workspace (una conexión por operación)."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+
+    def exists(self) -> bool:
+        return self.db_path.exists()
+
+    def is_built(self) -> bool:
+        """True si ya se indexó alguna vez (la base puede existir solo con el mapa de partes)."""
+        if not self.exists():
+            return False
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM meta WHERE key = 'params'").fetchone() is not None
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        self._prepare()
+        conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _prepare(self):
+        """Crea el esquema y activa WAL (persistente en el archivo) la primera vez."""
+        try:
+            key = (str(self.db_path), os.stat(self.db_path).st_ino)
+        except FileNotFoundError:
+            key = None
+        if key in _prepared:
+            return
+        with _prepared_lock:
+            with closing(sqlite3.connect(str(self.db_path), timeout=30)) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+            _prepared.add((str(self.db_path), os.stat(self.db_path).st_ino))
+
+    # ---------- lectura ----------
+
+    def meta(self) -> Dict:
+        """Parámetros del último escaneo, versión y huellas de archivos (sin hits)."""
+        if not self.exists():
+            return {"params": None, "version": 0, "fingerprints": {}, "files": []}
+        with closing(self._connect()) as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            rows = conn.execute("SELECT name, size, mtime_ns, sha256 FROM files ORDER BY position").fetchall()
+        return {
+            "params": json.loads(meta["params"]) if "params" in meta else None,
+            "version": int(meta.get("version", 0)),
+            "fingerprints": {name: {"size": size, "mtime_ns": mtime_ns, "sha256": sha256}
+                             for name, size, mtime_ns, sha256 in rows},
+            "files": [row[0] for row in rows],
+        }
+
+    def version(self) -> int:
+        """Versión del índice (aumenta con cada actualización que cambia algo)."""
+        if not self.exists():
+            return 0
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def code_count(self) -> int:
+        if not self.exists():
+            return 0
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM codes").fetchone()[0]
+
+    def lookup(self, codes: Optional[Iterable[str]] = None) -> Dict[str, List[Dict]]:
+        """
+        Hits de los códigos pedidos (o de todos si codes es None), con el
+        mismo orden por código que tenía index.json.
+        """
+        if not self.exists():
+            return {}
+        by_code: Dict[str, List[Dict]] = {}
+        query = ("SELECT h.code, h.file, h.page, h.source FROM hits h "
+                 "JOIN files f ON f.name = h.file JOIN codes c ON c.code = h.code ")
+        with closing(self._connect()) as conn:
+            if codes is None:
+                batches = [conn.execute(query + f"ORDER BY c.seq, {_HITS_ORDER}")]
+            else:
+                wanted = list(dict.fromkeys(codes))
+                batches = []
+                for i in range(0, len(wanted), _IN_CHUNK):
+                    chunk = wanted[i:i + _IN_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    batches.append(conn.execute(
+                        query + f"WHERE h.code IN ({placeholders}) ORDER BY c.seq, {_HITS_ORDER}", chunk))
+            for rows in batches:
+                for code, file, page, source in rows:
+                    by_code.setdefault(code, []).append({"file": file, "page": page, "source": source})
+        return by_code
+
+    def sample(self, limit: int = 5) -> Dict[str, List[Dict]]:
+        """Primeros `limit` códigos del índice (para respuestas resumidas)."""
+        if not self.exists():
+            return {}
+        with closing(self._connect()) as conn:
+            codes = [row[0] for row in conn.execute("SELECT code FROM codes ORDER BY seq LIMIT ?", (limit,))]
+        return self.lookup(codes)
+
+    def iter_export(self) -> Iterator[str]:
+        """
+        Exporta el índice completo como JSON en trozos, sin cargarlo en memoria.
+        Starlette recorre el generador desde hilos distintos del pool, así que
+        la conexión se abre con check_same_thread=False (se usa desde un solo
+        hilo a la vez) y se cierra aunque el cliente corte la descarga.
+        """
+        meta = self.meta()
+        yield '{"by_code": {'
+        if self.exists():
+            with closing(self._connect(check_same_thread=False)) as conn:
+                rows = conn.execute(
+                    "SELECT h.code, h.file, h.page, h.source FROM hits h "
+                    "JOIN files f ON f.name = h.file JOIN codes c ON c.code = h.code "
+                    f"ORDER BY c.seq, {_HITS_ORDER}")
+                current = None
+                for code, file, page, source in rows:
+                    hit = json.dumps({"file": file, "page": page, "source": source}, ensure_ascii=False)
+                    if code != current:
+                        prefix = "" if current is None else "], "
+                        yield f"{prefix}{json.dumps(code, ensure_ascii=False)}: [{hit}"
+                        current = code
+                    else:
+                        yield f", {hit}"
+                if current is not None:
+                    yield "]"
+        yield '}, "files": ' + json.dumps(meta["files"], ensure_ascii=False)
+        yield ', "fingerprints": ' + json.dumps(meta["fingerprints"], ensure_ascii=False)
+        yield ', "params": ' + json.dumps(meta["params"], ensure_ascii=False) + "}"
+
+    def parts_map(self, stamp: int) -> Optional[Dict[str, List[str]]]:
+        """
+        Mapa {base en minúsculas: [nombres de partes ordenados por N]} si se
+        guardó con la misma marca de uploads/ (mtime del directorio); si no, None.
+        """
+        if not self.exists():
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'parts_stamp'").fetchone()
+            if row is None or int(row[0]) != stamp:
+                return None
+            parts: Dict[str, List[str]] = {}
+            for base, name in conn.execute("SELECT base, name FROM parts ORDER BY base, idx, name"):
+                parts.setdefault(base, []).append(name)
+        return parts
+
+    def get_result(self, key: str) -> Optional[Dict]:
+        """Registro de un resultado cacheado: output, size, mtime_ns, owned y result (dict)."""
+        if not self.exists():
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT output, size, mtime_ns, owned, result FROM results WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        output, size, mtime_ns, owned, result = row
+        return {"output": output, "size": size, "mtime_ns": mtime_ns, "owned": bool(owned),
+                "result": json.loads(result)}
+
+    def results_by_age(self) -> List[Dict]:
+        """Resultados cacheados del menos al más recientemente usado."""
+        if not self.exists():
+            return []
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT key, output, size, owned FROM results ORDER BY last_used").fetchall()
+        return [{"key": key, "output": output, "size": size, "owned": bool(owned)}
+                for key, output, size, owned in rows]
+
+    # ---------- escritura ----------
+
+    def save_parts(self, stamp: int, parts: Dict[str, List[tuple]]):
+        """Reemplaza el mapa de partes: {base: [(N, nombre), ...]}."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM parts")
+            conn.executemany("INSERT INTO parts (base, idx, name) VALUES (?, ?, ?)",
+                             ((base, idx, name) for base, items in parts.items() for idx, name in items))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('parts_stamp', ?)", (str(stamp),))
+
+    def put_result(self, key: str, output: str, size: int, mtime_ns: int, owned: bool,
+                   result: Dict, now: float):
+        """
+        Registra un resultado. Otro registro que apuntara al mismo archivo de
+        salida se descarta (el archivo fue sobrescrito).
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM results WHERE output = ? AND key != ?", (output, key))
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, output, size, mtime_ns, owned, result, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, output, size, mtime_ns, int(owned), json.dumps(result, ensure_ascii=False), now))
+
+    def touch_result(self, key: str, now: float):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+
+    def drop_result(self, key: str):
+        if not self.exists():
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def clear_parts(self):
+        """Invalida el mapa de partes (p. ej. tras una subida)."""
+        if not self.exists():
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM meta WHERE key = 'parts_stamp'")
+
+    def apply_update(self, files: List[str], fingerprints: Dict[str, Dict], params: Dict,
+                     by_code: Dict[str, List[Dict]], dropped: Iterable[str] = (), full: bool = False) -> int:
+        """
+        Aplica un escaneo en una sola transacción:
+        - full=True: reemplaza todos los hits
+        - full=False: borra los hits de `dropped` (archivos modificados/eliminados)
+          y agrega los de `by_code` (archivos re-escaneados)
+        `files` es la lista completa (ordenada) de archivos del workspace.
+        Devuelve la nueva versión del índice.
+        """
+        with closing(self._connect()) as conn, conn:
+            if full:
+                conn.execute("DELETE FROM hits")
+                conn.execute("DELETE FROM codes")
+            else:
+                dropped = list(dropped)
+                for i in range(0, len(dropped), _IN_CHUNK):
+                    chunk = dropped[i:i + _IN_CHUNK]
+                    conn.execute(f"DELETE FROM hits WHERE file IN ({','.join('?' * len(chunk))})", chunk)
+                conn.execute("DELETE FROM codes WHERE code NOT IN (SELECT DISTINCT code FROM hits)")
+
+            conn.execute("DELETE FROM files")
+            conn.executemany(
+                "INSERT INTO files (name, position, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                ((name, pos, fingerprints[name]["size"], fingerprints[name]["mtime_ns"], fingerprints[name]["sha256"])
+                 for pos, name in enumerate(files)))
+
+            next_seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM codes").fetchone()[0]
+            conn.executemany("INSERT OR IGNORE INTO codes (code, seq) VALUES (?, ?)",
+                             ((code, next_seq + i) for i, code in enumerate(by_code)))
+            conn.executemany(
+                "INSERT INTO hits (code, file, page, source) VALUES (?, ?, ?, ?)",
+                ((code, h["file"], h["page"], h.get("source", "content"))
+                 for code, hits in by_code.items() for h in hits))
+
+            version = int((conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone() or ["0"])[0]) + 1
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [("params", json.dumps(params, ensure_ascii=False)), ("version", str(version))])
+        return version
+
+    def import_legacy(self, index: Dict):
+        """Importa un index.json antiguo (sin huellas se re-escaneará en el próximo /index)."""
+        files = index.get("files", [])
+        fingerprints = index.get("fingerprints") or {}
+        fps = {name: fingerprints.get(name, {"size": -1, "mtime_ns": -1, "sha256": ""}) for name in files}
+        self.apply_update(files, fps, index.get("params") or {}, index.get("by_code", {}), full=True)
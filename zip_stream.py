@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generación de un ZIP en streaming.
+zipfile escribe en un sumidero sin seek (usa descriptores de datos) y los
+bytes se entregan a medida que se producen, así el ZIP nunca está entero en
+memoria ni en disco. Los PDFs ya van comprimidos: se guardan sin comprimir.
+"""
+
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple, Union
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class _ZipSink:
+    """Archivo de solo escritura (sin seek ni tell) que acumula los bytes a entregar."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        if chunks:
+            yield b"".join(chunks)
+
+
+def iter_zip(entries: Iterable[Tuple[str, Union[Path, bytes]]]) -> Iterator[bytes]:
+    """
+    Bytes de un ZIP con las entradas (nombre_en_zip, ruta o contenido).
+    Los archivos se copian por trozos de ZIP_CHUNK_SIZE.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                zf.writestr(arcname, source)
+                yield from sink.drain()
+                continue
+            with Path(source).open("rb") as src, zf.open(arcname, "w") as dst:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b""):
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()